@@ -5,21 +5,51 @@
 
 from aiogram import types
 from aiogram.dispatcher import FSMContext
-from config import YOUR_ADMIN_ID
+from config import YOUR_ADMIN_ID, SEARCH_PAGE_SIZE, OPEN_VOTE_PAGE_SIZE, OPEN_VOTE_TEXT_LIMIT, OPEN_VOTE_DESCRIPTION_LIMIT, MESSAGE_LIMIT
 from aiogram.types import ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
+from aiogram.utils.markdown import quote_html
 from event import * 
+import asyncio
 import io
-import pandas as pd
-import matplotlib.pyplot as plt
-from bot_instance import bot
-from state import EventState
+from bot_instance import bot, send_scheduler
+import send_queue
+from send_queue import PRIORITY_REPORT
+from broadcast import broadcaster, event_announcement
+from backup import backups
+from charts import renderer, chart_cache, ChartBusyError
+from exports import export_open_vote, export_workshop_roster
+from db_instance import db
+from state import EventState, SearchState
 import os
 
 
-db = EventDatabase()
 
 
 
+# Кнопка рассылки анонса, показывается после создания события
+def broadcast_keyboard(event_id):
+    return InlineKeyboardMarkup().add(
+        InlineKeyboardButton("📢 Оповестить пользователей", callback_data=f"broadcast_event_{event_id}")
+    )
+
+
+# Кнопки выгрузки отчёта файлом; kind: open_vote, classes или groups
+def export_keyboard(kind, event_id, keyboard=None):
+    keyboard = keyboard or InlineKeyboardMarkup()
+    return keyboard.row(
+        InlineKeyboardButton("📥 Excel", callback_data=f"export_{kind}_xlsx_{event_id}"),
+        InlineKeyboardButton("📥 CSV", callback_data=f"export_{kind}_csv_{event_id}"),
+    )
+
+
+# Подпись кнопки события в админских списках: название и живые цифры из сводки
+def event_button_text(event):
+    if event['event_type'] == 'workshop':
+        return (f"{event['event_name']} ({event['workshops']} МК, "
+                f"{event['seats_taken']}/{event['seats_total']} мест)")
+    return f"{event['event_name']} ({event['responses']} отв., {event['voters']} чел.)"
+
 
 async def add_event(message: types.Message):
     if message.from_user.id != YOUR_ADMIN_ID:
@@ -91,7 +121,8 @@ async def process_event_description(message: types.Message, state: FSMContext):
         
         await message.reply(
             f"✅ Голосование со свободным ответом '{event_name}' создано!\n\n"
-            "Пользователи смогут вводить свой текст при голосовании."
+            "Пользователи смогут вводить свой текст при голосовании.",
+            reply_markup=broadcast_keyboard(event_id),
         )
         await state.finish()
     else:  # workshop
@@ -109,10 +140,10 @@ async def process_vote_options(message: types.Message, state: FSMContext):
 
     event_id = await db.get_event_id_by_name(event_name)
 
-    for option in options:
-        await db.add_option(event_id=event_id, option_text=option.strip())
+    await db.add_options(event_id, [option.strip() for option in options])
 
-    await message.reply(f"Варианты голосования для '{data['event_name']}' добавлены!", parse_mode="HTML")
+    await message.reply(f"Варианты голосования для '{data['event_name']}' добавлены!", parse_mode="HTML",
+                        reply_markup=broadcast_keyboard(event_id))
     await state.finish()
 
 
@@ -130,6 +161,48 @@ async def choose_workshop_method(callback_query: types.CallbackQuery, state: FSM
 
 
 
+# Разбирает Excel с мастер-классами прямо из памяти.
+# Колонки: ведущий, название, описание, макс. участников; первая строка — заголовок.
+# Возвращает (строки для вставки, список ошибок по строкам)
+def parse_workshops_excel(data):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(data, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        workshops = []
+        errors = []
+        for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+            values = list(row[:4]) + [None] * (4 - len(row[:4]))
+            if all(value is None or str(value).strip() == "" for value in values):
+                continue  # пустые строки в конце листа
+
+            instructor, workshop_name, workshop_description, max_participants = (
+                str(value).strip() if value is not None else "" for value in values
+            )
+            row_errors = []
+            if not instructor:
+                row_errors.append("нет ведущего")
+            if not workshop_name:
+                row_errors.append("нет названия")
+            if not workshop_description:
+                row_errors.append("нет описания")
+            try:
+                max_participants = int(float(max_participants))
+                if max_participants <= 0:
+                    row_errors.append("количество участников должно быть больше нуля")
+            except (ValueError, OverflowError):  # OverflowError — «inf», «1e999»
+                row_errors.append(f"количество участников «{max_participants}» не число")
+
+            if row_errors:
+                errors.append(f"Строка {row_number}: {', '.join(row_errors)}")
+            else:
+                workshops.append((workshop_name, workshop_description, instructor, max_participants))
+        return workshops, errors
+    finally:
+        workbook.close()
+
+
 async def handle_excel_file(message: types.Message, state: FSMContext):
     if message.document.mime_type != 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
         await message.reply("Пожалуйста, загрузите файл в формате Excel (.xlsx).")
@@ -140,47 +213,41 @@ async def handle_excel_file(message: types.Message, state: FSMContext):
     file = await bot.get_file(file_id)
     file_path = file.file_path
 
-    # Скачиваем файл
+    # Скачиваем файл в память, на диск ничего не пишем
     downloaded_file = await bot.download_file(file_path)
 
-    current_directory = './'
-    local_file_path = f"{current_directory}{message.document.file_name}"
-
     try:
-        with open(local_file_path, 'wb') as f:
-            f.write(downloaded_file.getvalue())
-
-        df = pd.read_excel(local_file_path)
-
-        df.columns = ['instructor', 'workshop_name', 'workshop_description', 'max_participants']
-
-        for index, row in df.iterrows():
-            workshop_name = row['workshop_name']
-            workshop_description = row['workshop_description']
-            instructor = row['instructor']
-            max_participants = row['max_participants']
-
-            # Получаем данные из состояния
-            data = await state.get_data()
-            event_name = data['event_name']
+        # Разбор в отдельном потоке, чтобы большой файл не блокировал остальных
+        loop = asyncio.get_running_loop()
+        workshops, errors = await loop.run_in_executor(None, parse_workshops_excel, downloaded_file)
+    except Exception as e:
+        await message.reply(f"Ошибка при обработке файла: {e}")
+        return
 
-            # Получаем event_id по названию события
-            event_id = await db.get_event_id_by_name(event_name)
+    if errors:
+        shown = "\n".join(errors[:30])
+        more = f"\n…и ещё {len(errors) - 30}" if len(errors) > 30 else ""
+        await message.reply(
+            f"❌ Файл не загружен, исправьте ошибки и отправьте его снова:\n\n{shown}{more}"
+        )
+        return
 
-            # Добавляем мастер-класс в базу данных
-            await db.add_workshop(
-                event_id=event_id,
-                workshop_name=workshop_name,
-                workshop_description=workshop_description,
-                instructor=instructor,
-                max_participants=max_participants
-            )
+    if not workshops:
+        await message.reply("В файле нет ни одного мастер-класса.")
+        return
 
-        await message.reply("Мастер-классы успешно загружены из Excel файла.")
-        await state.finish()
+    data = await state.get_data()
+    event_id = await db.get_event_id_by_name(data['event_name'])
 
+    try:
+        # Все мастер-классы одной транзакцией
+        await db.add_workshops(event_id, workshops)
     except Exception as e:
-        await message.reply(f"Ошибка при обработке файла: {e}")
+        await message.reply(f"Ошибка при сохранении мастер-классов: {e}")
+        return
+
+    await message.reply(f"Мастер-классы успешно загружены из Excel файла: {len(workshops)} шт.")
+    await state.finish()
 
 
 
@@ -226,7 +293,10 @@ async def process_more_workshops(callback_query: types.CallbackQuery, state: FSM
         await callback_query.message.reply("Введите имя мастер-класса:")
         await EventState.waiting_for_workshop_instructor.set()
     else:
-        await callback_query.message.reply("Добавление мастер-классов завершено. Спасибо!")
+        data = await state.get_data()
+        event_id = await db.get_event_id_by_name(data.get("event_name"))
+        await callback_query.message.reply("Добавление мастер-классов завершено. Спасибо!",
+                                           reply_markup=broadcast_keyboard(event_id) if event_id else None)
         await state.finish()
 
 
@@ -236,16 +306,14 @@ async def view_events(message: types.Message):
             await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode="HTML")
             return
 
-        events = await db.get_all_events()
+        events = await db.get_events_overview()
         if not events:
             await message.reply("<b>Нет доступных событий.</b>", parse_mode="HTML")
             return
 
         keyboard = InlineKeyboardMarkup()
         for event in events:
-            event_id = event['event_id']
-            event_name = event['event_name']
-            keyboard.add(InlineKeyboardButton(f"{event_name}", callback_data=f"admin_view_event_{event_id}"))
+            keyboard.add(InlineKeyboardButton(event_button_text(event), callback_data=f"admin_view_event_{event['event_id']}"))
 
         await message.reply("<b>Доступные события:</b>\nВыберите событие для подробной информации:", parse_mode="HTML", reply_markup=keyboard)
 
@@ -301,7 +369,7 @@ async def admin_delete_event(callback_query: types.CallbackQuery):
 
 
 async def admin_back_to_events(callback_query: types.CallbackQuery):
-    events = await db.get_all_events()  # Получаем все события
+    events = await db.get_events_overview()  # Все события с цифрами одним запросом
 
     if not events:
         await callback_query.message.edit_text("<b>Нет доступных событий.</b>", parse_mode="HTML")
@@ -309,12 +377,7 @@ async def admin_back_to_events(callback_query: types.CallbackQuery):
 
     keyboard = InlineKeyboardMarkup()
     for event in events:
-        # Обращаемся к элементам через ключи
-        event_id = event['event_id']
-        event_name = event['event_name']
-
-        # Добавление кнопки для события
-        keyboard.add(InlineKeyboardButton(f"{event_name}", callback_data=f"admin_view_event_{event_id}"))
+        keyboard.add(InlineKeyboardButton(event_button_text(event), callback_data=f"admin_view_event_{event['event_id']}"))
 
     await callback_query.message.edit_text("<b>Доступные события:</b>\nВыберите событие для подробной информации:", parse_mode="HTML", reply_markup=keyboard)
 
@@ -326,8 +389,7 @@ async def select_workshop_event(message: types.Message):
         await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode=ParseMode.HTML)
         return
 
-    events = await db.get_all_events()
-    workshop_events = [event for event in events if event['event_type'] == 'workshop']
+    workshop_events = await db.get_events_overview(["workshop"])
 
     if not workshop_events:
         await message.reply("<b>Нет доступных событий с мастер-классами.</b>", parse_mode=ParseMode.HTML)
@@ -336,7 +398,7 @@ async def select_workshop_event(message: types.Message):
     keyboard = InlineKeyboardMarkup()
     for event in workshop_events:
         keyboard.add(InlineKeyboardButton(
-            event['event_name'],
+            event_button_text(event),
             callback_data=f"visualize_workshop_event_{event['event_id']}"
         ))
 
@@ -350,8 +412,8 @@ async def select_open_vote_event(message: types.Message):
         await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode=ParseMode.HTML)
         return
 
-    events = await db.get_all_events()
-    open_vote_events = [event for event in events if event['event_type'] == 'open_vote']
+    # Количество ответов считает сводка, тексты ответов не выгружаются
+    open_vote_events = await db.get_events_overview(["open_vote"])
 
     if not open_vote_events:
         await message.reply("<b>Нет доступных открытых голосований.</b>", parse_mode=ParseMode.HTML)
@@ -359,12 +421,8 @@ async def select_open_vote_event(message: types.Message):
 
     keyboard = InlineKeyboardMarkup()
     for event in open_vote_events:
-        # Получаем количество ответов для этого голосования
-        responses = await db.get_open_vote_responses(event['event_id'])
-        response_count = len(responses)
-        
         keyboard.add(InlineKeyboardButton(
-            f"{event['event_name']} ({response_count} ответов)",
+            event_button_text(event),
             callback_data=f"visualize_open_vote_{event['event_id']}"
         ))
 
@@ -384,10 +442,41 @@ async def select_visualization_method(callback_query: types.CallbackQuery):
         reply_markup=InlineKeyboardMarkup().add(
             InlineKeyboardButton("По отрядам", callback_data=f"visualize_by_groups_{event_id}"),
             InlineKeyboardButton("По мастер-классам", callback_data=f"visualize_by_classes_{event_id}")
+        ).row(
+            InlineKeyboardButton("📥 Excel по МК", callback_data=f"export_classes_xlsx_{event_id}"),
+            InlineKeyboardButton("📥 Excel по отрядам", callback_data=f"export_groups_xlsx_{event_id}")
+        ).row(
+            InlineKeyboardButton("📥 CSV по МК", callback_data=f"export_classes_csv_{event_id}"),
+            InlineKeyboardButton("📥 CSV по отрядам", callback_data=f"export_groups_csv_{event_id}")
         )
     )
 
 
+# Выгружает отчёт одним файлом: строки идут из базы пачками прямо в документ
+async def export_report(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != YOUR_ADMIN_ID:
+        await callback_query.answer("У вас нет прав на выполнение этой команды.", show_alert=True)
+        return
+
+    kind, fmt, event_id = callback_query.data[len("export_"):].rsplit("_", 2)
+    event_id = int(event_id)
+    await callback_query.answer("Готовим файл...")
+
+    if kind == "open_vote":
+        document, rows = await export_open_vote(db, event_id, fmt)
+        caption = f"Ответов: {rows}"
+    else:
+        document, rows = await export_workshop_roster(db, event_id, kind, fmt)
+        caption = f"Записей: {rows}"
+
+    if not rows:
+        await callback_query.message.answer("<b>Нет данных для выгрузки.</b>", parse_mode="HTML")
+        return
+
+    with send_queue.priority(PRIORITY_REPORT):
+        await callback_query.message.answer_document(document, caption=caption)
+
+
 
 async def visualize_by_classes(callback_query: types.CallbackQuery):
     event_id = int(callback_query.data.split("_")[-1])
@@ -426,8 +515,10 @@ async def visualize_by_classes(callback_query: types.CallbackQuery):
         messages.append(current_message)
 
     # Отправляем все части сообщений
-    for msg in messages:
-        await callback_query.message.answer(msg, parse_mode="HTML")
+    # Отчёт из многих частей уступает очередь ответам пользователям
+    with send_queue.priority(PRIORITY_REPORT):
+        for msg in messages:
+            await callback_query.message.answer(msg, parse_mode="HTML")
 
 
     
@@ -494,8 +585,10 @@ async def visualize_by_groups(callback_query: types.CallbackQuery):
         messages.append(current_message)
 
     # Отправляем все части сообщений
-    for msg in messages:
-        await callback_query.message.answer(msg, parse_mode="HTML")
+    # Отчёт из многих частей уступает очередь ответам пользователям
+    with send_queue.priority(PRIORITY_REPORT):
+        for msg in messages:
+            await callback_query.message.answer(msg, parse_mode="HTML")
 
 
 
@@ -506,7 +599,7 @@ async def visualize_vote(message: types.Message):
         await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode="HTML")
         return
 
-    events = await db.get_vote_events()
+    events = await db.get_events_overview(["vote"])
 
     if not events:
         await message.reply("<b>Нет доступных голосований для визуализации.</b>", parse_mode="HTML")
@@ -514,13 +607,88 @@ async def visualize_vote(message: types.Message):
 
     keyboard = InlineKeyboardMarkup()
     for event in events:
-        keyboard.add(InlineKeyboardButton(event['event_name'], callback_data=f"visualize_vote_{event['event_id']}"))
+        keyboard.add(InlineKeyboardButton(event_button_text(event), callback_data=f"visualize_vote_{event['event_id']}"))
 
     await message.reply("Выберите голосование для визуализации:", reply_markup=keyboard)
 
 
 
 
+async def rebuild_tallies(message: types.Message):
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode="HTML")
+        return
+
+    await db.rebuild_vote_tallies()
+    await message.reply("✅ Счётчики голосов пересчитаны по таблице ответов.")
+
+
+async def broadcast_menu(message: types.Message):
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode="HTML")
+        return
+
+    events = await db.get_events_overview()
+    if not events:
+        await message.reply("<b>Нет доступных событий.</b>", parse_mode="HTML")
+        return
+
+    users = await db.count_users()
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for event in events:
+        keyboard.add(InlineKeyboardButton(event_button_text(event), callback_data=f"broadcast_event_{event['event_id']}"))
+
+    running = broadcaster.running()
+    await message.reply(
+        f"<b>Пользователей в базе:</b> {users['total']} (заблокировали бота: {users['blocked']})\n"
+        + (f"Идут рассылки: {', '.join(f'#{b}' for b in running)}\n" if running else "")
+        + "\nВыберите событие для анонса:",
+        parse_mode="HTML",
+        reply_markup=keyboard,
+    )
+
+
+async def start_broadcast(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != YOUR_ADMIN_ID:
+        await callback_query.answer("Нет прав.", show_alert=True)
+        return
+
+    event_id = int(callback_query.data.split("_")[-1])
+    event = await db.get_event_by_id(event_id)
+    if not event:
+        await callback_query.answer("Событие не найдено!", show_alert=True)
+        return
+
+    broadcast_id = await broadcaster.start(event_id, event_announcement(event))
+    if broadcast_id is None:
+        await callback_query.answer("Рассылка по этому событию уже идёт.", show_alert=True)
+        return
+    await callback_query.answer()
+    await callback_query.message.answer(
+        f"📢 Рассылка #{broadcast_id} о событии '{event['event_name']}' запущена. "
+        "Итоги придут сообщением, когда она закончится."
+    )
+
+
+async def send_stats(message: types.Message):
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode="HTML")
+        return
+
+    stats = send_scheduler.get_stats()
+    await message.reply(
+        "<b>Очередь отправки:</b>\n"
+        f"В очереди: {stats['queued']} (ответы: {stats['queued_user']}, отчёты: {stats['queued_report']}, "
+        f"рассылки: {stats['queued_broadcast']})\n"
+        f"Чатов ждут: {stats['chats_waiting']}, отправляется: {stats['in_flight']}\n"
+        f"Максимум очереди: {stats['max_depth']}\n"
+        f"Отправлено: {stats['sent']}, ошибок: {stats['errors']}, RetryAfter: {stats['retry_after']}",
+        parse_mode="HTML",
+    )
+
+
+
+
 async def visualize_vote_results(callback_query: types.CallbackQuery):
     event_id = int(callback_query.data.split("_")[2])
 
@@ -544,65 +712,35 @@ async def visualize_vote_results(callback_query: types.CallbackQuery):
     counts = [vote['vote_count'] for vote in votes]
     percentages = [(count / total_votes) * 100 if total_votes > 0 else 0 for count in counts]
 
-    # Определяем уникальные цвета для графика
-    colors = [
-        "#FF5733",  # Красный
-        "#33FF57",  # Зеленый
-        "#3357FF",  # Синий
-        "#FF33A8",  # Розовый
-        "#8A33FF",  # Фиолетовый
-        "#33FFF3",  # Бирюзовый
-        "#FF8A33",  # Оранжевый
-        "#FFCC00",  # Желтый
-        "#F0E68C",  # Хаки
-        "#D2691E",  # Шоколадный
-        "#9932CC",  # Темно-фиолетовый
-        "#FF6347",  # Томатный
-        "#ADFF2F",  # Зелёный с лимонным оттенком
-        "#FF1493",  # Дикий розовый
-        "#FF4500",  # Оранжево-красный
-        "#20B2AA",  # Светло-бирюзовый
-        "#800080",  # Пурпурный
-        "#FFD700",  # Золотой
-        "#2F4F4F",  # Темно-серый
-        "#800000",  # Бардовый
-    ]
-
-
-    colors = colors[:len(options)]
-
-    plt.figure(figsize=(10, 6))
-    bars = plt.bar(options, counts, color=colors, edgecolor="black")
-
-    for bar, percentage in zip(bars, percentages):
-        y_position = bar.get_height() / 2 if bar.get_height() > 0 else 0.2
-        plt.text(
-            bar.get_x() + bar.get_width() / 2,
-            y_position,
-            f"{percentage:.1f}%",
-            ha="center",
-            va="center",
-            fontsize=10,
-            color="black",
-            weight="bold"
-        )
-
-    plt.title("Результаты голосования", fontsize=16, weight="bold")
-    plt.xlabel("Варианты", fontsize=12, weight="bold")
-    plt.ylabel("Количество голосов", fontsize=12, weight="bold")
-    plt.xticks(rotation=30, ha="right", fontsize=10)
-    plt.grid(axis="y", linestyle="--", alpha=0.7)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight")
-    buf.seek(0)
-    plt.close()
+    # Пока счётчики не менялись, повторно отправляем уже загруженную в Telegram картинку
+    fingerprint = tuple(zip(options, counts))
+    cached = chart_cache.get(event_id, fingerprint)
+    if cached and cached["file_id"]:
+        try:
+            await callback_query.message.answer_photo(photo=cached["file_id"], caption=results_text, parse_mode=ParseMode.HTML)
+            return
+        except BadRequest as e:
+            print(f"Не удалось переиспользовать file_id графика: {e}")
+            chart_cache.put(event_id, fingerprint, cached["png"], file_id=None)
 
-    photo = types.InputFile(buf, filename="vote_results.png")
-    await callback_query.message.answer_photo(photo=photo, caption=results_text, parse_mode=ParseMode.HTML)
+    if cached:
+        png = cached["png"]
+    else:
+        # Рисуем в отдельном процессе, чтобы не блокировать остальных пользователей
+        try:
+            png = await renderer.render_vote_chart(options, counts, percentages)
+        except ChartBusyError:
+            await callback_query.message.answer("⏳ Сейчас строится много графиков, попробуйте через минуту.")
+            return
+        except asyncio.TimeoutError:
+            await callback_query.message.answer("❌ Не удалось построить график: превышено время ожидания.")
+            return
+        chart_cache.put(event_id, fingerprint, png)
 
-    buf.close()
+    photo = types.InputFile(io.BytesIO(png), filename="vote_results.png")
+    sent = await callback_query.message.answer_photo(photo=photo, caption=results_text, parse_mode=ParseMode.HTML)
+    if sent.photo:
+        chart_cache.put(event_id, fingerprint, png, file_id=sent.photo[-1].file_id)
 
 async def get_open_vote_stats(self, event_id: int):
     """
@@ -645,6 +783,82 @@ async def get_open_vote_stats(self, event_id: int):
             "avg_response_length": round(avg_length, 1) if avg_length else 0
         }
     
+# Одна страница ответов открытого голосования: текст сообщения и кнопки ◀/▶ и выгрузки.
+# first_number — порядковый номер первого ответа на странице (1 — самый новый)
+def open_vote_entry(number, response):
+    date_part = str(response['response_time']).split()[0] if response['response_time'] else ""
+    custom_text = response['custom_text'] or "Без текста"
+    if len(custom_text) > OPEN_VOTE_TEXT_LIMIT:
+        custom_text = custom_text[:OPEN_VOTE_TEXT_LIMIT] + "…"
+    return (
+        f"<b>{number}. {quote_html(response['user_name'])}</b>"
+        f"{f' ({date_part})' if date_part else ''}:\n"
+        f"<i>{quote_html(custom_text)}</i>\n"
+    )
+
+
+async def open_vote_page(event, first_number, stats="", older_than=None, newer_than=None):
+    """
+    Страница ответов открытого голосования: текст и клавиатура.
+    first_number — номер первого ответа страницы, а при newer_than — номер ответа сразу после неё.
+    На странице до OPEN_VOTE_PAGE_SIZE ответов, но не больше, чем влезает в одно сообщение
+    """
+    event_id = event['event_id']
+    page = await db.get_open_vote_page(event_id, OPEN_VOTE_PAGE_SIZE, older_than, newer_than)
+    responses = page["responses"]
+
+    description = event['event_description']
+    if len(description) > OPEN_VOTE_DESCRIPTION_LIMIT:
+        description = description[:OPEN_VOTE_DESCRIPTION_LIMIT] + "…"
+    header = (
+        f"📊 <b>Результаты открытого голосования</b>\n\n"
+        f"<b>Название:</b> {event['event_name']}\n"
+        f"<b>Описание:</b> {description}\n\n"
+        f"{stats}"
+    )
+
+    # Берём ответы, ближайшие к месту, откуда пришли, пока текст влезает в лимит Telegram.
+    # Номер в строке ещё не известен — резервируем под него место
+    budget = MESSAGE_LIMIT - len(header) - 64
+    ordered = list(reversed(responses)) if newer_than is not None else responses
+    shown = []
+    for response in ordered:
+        size = len(open_vote_entry(0, response)) + 12
+        if shown and size > budget:
+            break
+        budget -= size
+        shown.append(response)
+    if newer_than is not None:
+        shown.reverse()
+        first_number = max(first_number - len(shown), 1)
+        has_newer = page["has_newer"] or len(shown) < len(responses)
+        has_older = page["has_older"]
+    else:
+        has_newer = page["has_newer"]
+        has_older = page["has_older"] or len(shown) < len(responses)
+
+    lines = [header + f"📝 <b>Ответы {first_number}–{first_number + len(shown) - 1}:</b>\n"]
+    for number, response in enumerate(shown, first_number):
+        lines.append(open_vote_entry(number, response))
+
+    # В кнопке — ключ крайнего ответа страницы, от него строится соседняя страница
+    buttons = []
+    if shown and has_newer:
+        newest = shown[0]
+        buttons.append(InlineKeyboardButton("◀", callback_data=(
+            f"ovp_{event_id}_n_{first_number}_"
+            f"{newest['response_id']}_{newest['response_time']}")))
+    if shown and has_older:
+        oldest = shown[-1]
+        buttons.append(InlineKeyboardButton("▶", callback_data=(
+            f"ovp_{event_id}_o_{first_number + len(shown)}_"
+            f"{oldest['response_id']}_{oldest['response_time']}")))
+    keyboard = InlineKeyboardMarkup()
+    if buttons:
+        keyboard.row(*buttons)
+    return "\n".join(lines), export_keyboard("open_vote", event_id, keyboard)
+
+
 async def process_open_vote_selection(callback_query: types.CallbackQuery):
     """
     Обрабатывает выбор конкретного открытого голосования
@@ -657,10 +871,8 @@ async def process_open_vote_selection(callback_query: types.CallbackQuery):
             await callback_query.answer("Событие не найдено или не является открытым голосованием!", show_alert=True)
             return
         
-        # Получаем ответы
-        responses = await db.get_open_vote_responses(event_id)
-        
-        if not responses:
+        overview = await db.get_response_stats(event_id)
+        if not overview['responses']:
             await callback_query.message.answer(
                 f"📊 <b>Результаты открытого голосования</b>\n\n"
                 f"<b>Название:</b> {event['event_name']}\n"
@@ -669,69 +881,153 @@ async def process_open_vote_selection(callback_query: types.CallbackQuery):
                 parse_mode=ParseMode.HTML
             )
             return
-        
-        # Формируем заголовок
-        header = (
-            f"📊 <b>Результаты открытого голосования</b>\n\n"
-            f"<b>Название:</b> {event['event_name']}\n"
-            f"<b>Описание:</b> {event['event_description']}\n\n"
+
+        stats = (
             f"📈 <b>Статистика:</b>\n"
-            f"• Всего ответов: {len(responses)}\n"
-            f"• Уникальных пользователей: {len(set(r['user_name'] for r in responses))}\n\n"
-            f"📝 <b>Все ответы:</b>\n\n"
+            f"• Всего ответов: {overview['responses']}\n"
+            f"• Уникальных пользователей: {overview['voters']}\n\n"
         )
-        
-        # Разбиваем на части для отправки
-        messages = []
-        current_message = header
-        
-        for i, response in enumerate(responses, 1):
-            # Форматируем дату
-            date_part = ""
-            if response['response_time']:
-                try:
-                    date_part = str(response['response_time']).split()[0]
-                except:
-                    pass
-            
-            # Формируем строку с ответом
-            response_text = (
-                f"<b>{i}. {response['user_name']}</b>"
-                f"{f' ({date_part})' if date_part else ''}:\n"
-                f"<i>{response['custom_text']}</i>\n\n"
-            )
-            
-            # Проверяем длину
-            if len(current_message) + len(response_text) > 4000:
-                messages.append(current_message)
-                current_message = response_text
-            else:
-                current_message += response_text
-        
-        # Добавляем последнюю часть
-        if current_message:
-            messages.append(current_message)
-        
-        # Отправляем все части
-        for msg in messages:
-            await callback_query.message.answer(msg, parse_mode=ParseMode.HTML)
-        
+        text, keyboard = await open_vote_page(event, 1, stats)
+        await callback_query.message.answer(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
     except Exception as e:
         print(f"Error in process_open_vote_selection: {e}")
         await callback_query.answer("Произошла ошибка!", show_alert=True)
 
 
+# Листает ответы открытого голосования, редактируя то же сообщение
+async def open_vote_page_navigation(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != YOUR_ADMIN_ID:
+        await callback_query.answer("У вас нет прав на выполнение этой команды.", show_alert=True)
+        return
+
+    _, event_id, direction, first_number, response_id, response_time = callback_query.data.split("_", 5)
+    event = await db.get_event_by_id(int(event_id))
+    if not event:
+        await callback_query.answer("Событие не найдено!", show_alert=True)
+        return
+
+    key = (response_time, int(response_id))
+    if direction == "o":
+        text, keyboard = await open_vote_page(event, int(first_number), older_than=key)
+    else:
+        text, keyboard = await open_vote_page(event, int(first_number), newer_than=key)
+    try:
+        await callback_query.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
+
+
+async def search_answers(message: types.Message):
+    """
+    Поиск по текстам ответов открытого голосования: сначала выбирается голосование
+    """
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await message.reply("<b>Ошибка:</b> У вас нет прав на выполнение этой команды.", parse_mode=ParseMode.HTML)
+        return
+
+    open_vote_events = await db.get_events_overview(["open_vote"])
+    if not open_vote_events:
+        await message.reply("<b>Нет доступных открытых голосований.</b>", parse_mode=ParseMode.HTML)
+        return
+
+    keyboard = InlineKeyboardMarkup()
+    for event in open_vote_events:
+        keyboard.add(InlineKeyboardButton(event_button_text(event), callback_data=f"search_open_vote_{event['event_id']}"))
+
+    await message.reply("<b>Выберите голосование для поиска по ответам:</b>", parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def choose_search_event(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id != YOUR_ADMIN_ID:
+        await callback_query.answer("У вас нет прав на выполнение этой команды.", show_alert=True)
+        return
+
+    event_id = int(callback_query.data.split("_")[-1])
+    await state.update_data(search_event_id=event_id)
+    await SearchState.waiting_for_query.set()
+    await callback_query.message.answer(
+        "🔎 Введите слова для поиска. Ищутся ответы, где есть все слова (можно начало слова)."
+    )
+    await callback_query.answer()
+
+
+# Страница результатов поиска: текст сообщения и кнопки ◀/▶
+async def search_results_page(event_id, text, offset):
+    total, results = await db.search_open_vote_responses(event_id, text, SEARCH_PAGE_SIZE, offset)
+    if not total:
+        return f"🔎 По запросу <b>{quote_html(text)}</b> ничего не найдено.", None
+
+    lines = [f"🔎 <b>{quote_html(text)}</b>: найдено {total}, показаны {offset + 1}–{offset + len(results)}\n"]
+    for number, result in enumerate(results, offset + 1):
+        snippet = (quote_html(result['snippet'] or "")
+                   .replace(MATCH_START, "<b>").replace(MATCH_END, "</b>"))
+        date_part = str(result['response_time']).split()[0] if result['response_time'] else ""
+        lines.append(
+            f"<b>{number}. {quote_html(result['user_name'])}</b>"
+            f"{f' ({date_part})' if date_part else ''}:\n<i>{snippet}</i>\n"
+        )
+
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("◀", callback_data=f"search_page_{max(offset - SEARCH_PAGE_SIZE, 0)}"))
+    if offset + SEARCH_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton("▶", callback_data=f"search_page_{offset + SEARCH_PAGE_SIZE}"))
+    keyboard = InlineKeyboardMarkup().row(*buttons) if buttons else None
+    return "\n".join(lines), keyboard
+
+
+async def process_search_query(message: types.Message, state: FSMContext):
+    if message.from_user.id != YOUR_ADMIN_ID:
+        await state.finish()
+        return
+
+    data = await state.get_data()
+    event_id = data.get("search_event_id")
+    # Запрос остаётся в данных FSM, чтобы кнопки ◀/▶ могли листать результаты
+    await state.reset_state(with_data=False)
+    await state.update_data(search_query=message.text)
+
+    text, keyboard = await search_results_page(event_id, message.text, 0)
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+# Листает результаты поиска, редактируя то же сообщение
+async def search_page(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id != YOUR_ADMIN_ID:
+        await callback_query.answer("У вас нет прав на выполнение этой команды.", show_alert=True)
+        return
+
+    data = await state.get_data()
+    if "search_query" not in data:
+        await callback_query.answer("Поиск устарел, запустите /search_answers заново.", show_alert=True)
+        return
+
+    offset = int(callback_query.data.split("_")[-1])
+    text, keyboard = await search_results_page(data["search_event_id"], data["search_query"], offset)
+    try:
+        await callback_query.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
+
+
 async def cmd_send_all_db(message: types.Message):
     # Проверяем ID (лучше использовать список admins из конфига, но можно и жестко)
     if message.from_user.id == 1012078689:
-        db_files = ["events.db"]
-        
-        for db_name in db_files:
-            if os.path.exists(db_name):
-                # Используем with, чтобы файлы закрывались автоматически
-                with open(db_name, "rb") as file:
-                    await message.reply_document(file, caption=f"Файл: {db_name}")
-            else:
-                await message.reply(f"❌ Файл {db_name} не найден в директории.")
+        # Снимок через backup API: файл базы, в который бот продолжает писать, не копируем
+        try:
+            path = await backups.create(verify=True, manual=True)
+        except Exception as e:
+            print(f"Error in cmd_send_all_db: {e}")
+            await message.reply(f"❌ Не удалось снять копию базы: {e}")
+            return
+
+        await message.reply_document(
+            types.InputFile(path, filename=os.path.basename(path)),
+            caption=f"Копия {db.db_name} (gzip, integrity_check: ok)"
+        )
+        backups.prune()
     else:
-        await message.answer("У вас нет прав на эту команду.")
\ No newline at end of file
+        await message.answer("У вас нет прав на эту команду.")
@@ -0,0 +1,127 @@
+'''
+Резервные копии базы через online backup API SQLite.
+Копия снимается в отдельном потоке порциями страниц, поэтому не блокирует ни
+цикл событий, ни запись в базу. Затем она сжимается gzip и при необходимости
+проверяется PRAGMA integrity_check. Плановые копии хранятся в папке с ротацией.
+'''
+
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+
+from config import DB_NAME, BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, BACKUP_PAGES, BACKUP_VERIFY
+
+
+class BackupError(Exception):
+    """Копия не прошла проверку целостности"""
+
+
+class BackupManager:
+    def __init__(self, db_name, directory="backups", interval_hours=24, keep=7,
+                 pages=256, step_sleep=0.005, verify=True):
+        self.db_name = db_name
+        self.directory = directory
+        self.interval = interval_hours * 3600  # 0 — плановые копии выключены
+        self.keep = keep
+        self.pages = pages  # страниц за один шаг копирования
+        self.step_sleep = step_sleep  # пауза между шагами, секунды
+        self.verify = verify
+        self._lock = asyncio.Lock()  # одна копия за раз
+        self._task = None
+
+    def _prefix(self, manual=False):
+        return os.path.splitext(os.path.basename(self.db_name))[0] + ("-manual-" if manual else "-")
+
+    # Выполняется в потоке: снимок -> проверка -> сжатие. Возвращает путь к .gz
+    def _create(self, verify, manual):
+        os.makedirs(self.directory, exist_ok=True)
+        # Миллисекунды и pid: копии из разных воркеров в одну секунду не затирают друг друга
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now % 1 * 1000):03d}-{os.getpid()}"
+        name = self._prefix(manual) + stamp
+        snapshot = os.path.join(self.directory, name + ".db.tmp")
+        target = os.path.join(self.directory, name + ".db.gz")
+
+        try:
+            source = sqlite3.connect(self.db_name, isolation_level=None)
+            copy = sqlite3.connect(snapshot)
+            try:
+                # Открытая транзакция чтения фиксирует снимок WAL: шаги копируют одно
+                # и то же состояние базы. Без неё каждая запись бота перезапускала бы копию
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                source.backup(copy, pages=self.pages, sleep=self.step_sleep)
+                source.execute("COMMIT")
+
+                if verify:
+                    result = [row[0] for row in copy.execute("PRAGMA integrity_check")]
+                    if result != ["ok"]:
+                        raise BackupError("; ".join(result[:5]))
+            finally:
+                copy.close()
+                source.close()
+
+            with open(snapshot, "rb") as raw, gzip.open(target + ".tmp", "wb", compresslevel=6) as packed:
+                shutil.copyfileobj(raw, packed, 1024 * 1024)
+            os.replace(target + ".tmp", target)
+            return target
+        finally:
+            for path in (snapshot, target + ".tmp"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    async def create(self, verify=None, manual=False):
+        """
+        Снимает копию базы и возвращает путь к сжатому файлу.
+        Ручные копии (manual=True) ротируются отдельно и не вытесняют плановые
+        """
+        verify = self.verify if verify is None else verify
+        async with self._lock:
+            started = time.perf_counter()
+            path = await asyncio.get_running_loop().run_in_executor(None, self._create, verify, manual)
+            print(f"Резервная копия {path} ({os.path.getsize(path) // 1024} КБ) "
+                  f"за {time.perf_counter() - started:.1f} с")
+            return path
+
+    # Удаляет старые копии, оставляя keep последних плановых и keep последних ручных
+    def prune(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory) if name.endswith(".db.gz")]
+        manual = sorted(name for name in names if name.startswith(self._prefix(manual=True)))
+        scheduled = sorted(name for name in names if name.startswith(self._prefix()) and name not in manual)
+
+        removed = []
+        for backups in (scheduled, manual):
+            removed += backups[:-self.keep] if self.keep > 0 else []
+        for name in removed:
+            os.remove(os.path.join(self.directory, name))
+        return removed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.create()
+                self.prune()
+            except Exception as e:
+                print(f"Error in scheduled backup: {e}")
+
+    def start(self):
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+backups = BackupManager(DB_NAME, BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, BACKUP_PAGES, verify=BACKUP_VERIFY)
@@ -0,0 +1,533 @@
+'''
+Нагрузочный бенчмарк бота целиком.
+
+Поднимает локальную заглушку Telegram Bot API (aiohttp), запускает диспетчер
+из main.py в режиме polling или webhook и прогоняет тысячи синтетических
+пользователей по сценарию:
+/start → event_ → vote_ → event_ → workshop_ → select_workshop_ → имя → отряд.
+По каждому хендлеру считает p50/p95/p99, плюс общую пропускную способность,
+и сохраняет результат в JSON, чтобы сравнивать прогоны между собой.
+
+С --workers бот запускается через cluster.py (ingress + N процессов-воркеров)
+по очереди для каждого числа воркеров, и печатается таблица масштабирования.
+
+    python benchmark.py --users 2000 --concurrency 300 --mode webhook
+    python benchmark.py --users 5000 --concurrency 500 --workers 1,2,4
+'''
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web, ClientSession
+
+BENCH_TOKEN = "123456:BENCHMARKBENCHMARKBENCHMARKBENCHMAR"
+WEBHOOK_SECRET = "bench-secret"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(max(values), 3) if values else 0.0,
+    }
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API: отвечает на отправки правдоподобными объектами
+    и отдаёт через getUpdates апдейты, которые положил бенчмарк
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self._updates = []
+        self._has_updates = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    def push(self, update):
+        self._updates.append(update)
+        self._has_updates.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Подтверждённые (update_id < offset) больше не отдаём
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method.startswith("send") or method.startswith("editMessage") or method in ("forwardMessage", "copyMessage"):
+            result = self._message(params)
+        else:
+            # answerCallbackQuery, deleteMessage, deleteWebhook, setWebhook и прочее
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_route("POST", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class Benchmark:
+    def __init__(self, dp, mode, webhook_url=None):
+        self.dp = dp
+        self.mode = mode
+        self.webhook_url = webhook_url
+        self.api = FakeBotAPI()
+        self.session = None
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        # update_id -> (момент отправки апдейта, future с результатом обработки)
+        self._pending = {}
+        self._started = {}
+        self._handlers = {}
+        self.samples = defaultdict(list)  # хендлер -> время обработки, мс
+        self.end_to_end = defaultdict(list)  # хендлер -> от отправки апдейта до конца обработки, мс
+        self.errors = 0
+
+    # Мидлварь бенчмарка: засекает обработку каждого апдейта и имя хендлера
+    def middleware(self):
+        from aiogram import types
+        from aiogram.dispatcher.handler import current_handler
+        from aiogram.dispatcher.middlewares import BaseMiddleware
+
+        bench = self
+
+        class BenchMiddleware(BaseMiddleware):
+            async def on_pre_process_update(self, update: types.Update, data: dict):
+                bench._started[update.update_id] = time.perf_counter()
+
+            async def _remember_handler(self, *args):
+                handler = current_handler.get()
+                bench._handlers[types.Update.get_current().update_id] = handler.__name__
+
+            on_process_message = _remember_handler
+            on_process_callback_query = _remember_handler
+
+            async def on_post_process_update(self, update: types.Update, results, data: dict):
+                bench._finish(update.update_id)
+
+        return BenchMiddleware()
+
+    def _finish(self, update_id):
+        finished = time.perf_counter()
+        started = self._started.pop(update_id, finished)
+        handler = self._handlers.pop(update_id, "unhandled")
+        self._complete(update_id, handler, (finished - started) * 1000, finished)
+
+    # Подтверждение воркера cluster.py: имя хендлера в другой процесс не передаётся
+    def on_ack(self, ack):
+        self._complete(ack["update_id"], "cluster", ack["ms"], time.perf_counter())
+
+    def _complete(self, update_id, handler, processing_ms, finished):
+        sent_at, future = self._pending.pop(update_id, (None, None))
+        self.samples[handler].append(processing_ms)
+        if sent_at is not None:
+            self.end_to_end[handler].append((finished - sent_at) * 1000)
+        if future is not None and not future.done():
+            future.set_result(handler)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def message_update(self, user_id, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._callback_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+
+    def callback_update(self, user_id, data):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._callback_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "",
+                },
+            },
+        }
+
+    async def send(self, update, timeout=60):
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update["update_id"]] = (time.perf_counter(), future)
+        if self.mode == "webhook":
+            async with self.session.post(
+                self.webhook_url, json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+            ) as response:
+                await response.read()
+        else:
+            self.api.push(update)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.errors += 1
+            self._pending.pop(update["update_id"], None)
+            return None
+
+    async def user_flow(self, user_id, vote_event_id, option_id, workshop_event_id, workshop_id):
+        await self.send(self.message_update(user_id, "/start"))
+        await self.send(self.callback_update(user_id, f"event_{vote_event_id}"))
+        await self.send(self.callback_update(user_id, f"vote_{option_id}"))
+        await self.send(self.callback_update(user_id, f"event_{workshop_event_id}"))
+        await self.send(self.callback_update(user_id, f"workshop_{workshop_id}"))
+        await self.send(self.callback_update(user_id, f"select_workshop_{workshop_id}"))
+        await self.send(self.message_update(user_id, "Иван Петров"))
+        await self.send(self.message_update(user_id, str(user_id % 30 + 1)))
+
+
+async def seed(db, users, workshops):
+    await db.add_event("Бенчмарк: голосование", "Синтетическое голосование", "vote")
+    vote_event_id = await db.get_event_id_by_name("Бенчмарк: голосование")
+    for text in ("Первый", "Второй", "Третий", "Четвёртый"):
+        await db.add_option(vote_event_id, text)
+    options = [option["option_id"] for option in await db.get_event_options(vote_event_id)]
+
+    await db.add_event("Бенчмарк: мастер-классы", "Синтетические мастер-классы", "workshop")
+    workshop_event_id = await db.get_event_id_by_name("Бенчмарк: мастер-классы")
+    capacity = users // workshops + 1
+    await db.add_workshops(workshop_event_id, [
+        (f"Мастер-класс {i}", "Описание", "Ведущий", capacity) for i in range(1, workshops + 1)
+    ])
+    workshop_ids = [w["workshop_id"] for w in await db.get_workshops_by_event(workshop_event_id)]
+    return vote_event_id, options, workshop_event_id, workshop_ids
+
+
+async def run(args):
+    from aiogram.bot.api import TelegramAPIServer
+
+    import main
+    from bot_instance import bot, send_scheduler
+    from db_instance import db
+    import webhook
+
+    dp = main.dp
+    api_base = f"http://{args.host}:{args.api_port}"
+    bot.server = TelegramAPIServer.from_base(api_base)
+
+    webhook_url = f"http://{args.host}:{args.webhook_port}{webhook.WEBHOOK_PATH}"
+    bench = Benchmark(dp, args.mode, webhook_url)
+    dp.middleware.setup(bench.middleware())
+
+    await main.on_start(dp)
+    vote_event_id, options, workshop_event_id, workshop_ids = await seed(db, args.users, args.workshops)
+
+    await bench.api.start(args.host, args.api_port)
+    bench.session = ClientSession()
+    webhook_runner = None
+    polling_task = None
+    if args.mode == "webhook":
+        webhook.SecretWebhookRequestHandler.secret_token = WEBHOOK_SECRET
+        webhook_runner = web.AppRunner(webhook.build_app(dp), access_log=None)
+        await webhook_runner.setup()
+        await web.TCPSite(webhook_runner, args.host, args.webhook_port).start()
+    else:
+        # Те же параметры, что у executor.start_polling в main.py
+        polling_task = asyncio.create_task(dp.start_polling(timeout=20, relax=0.1))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one_user(index):
+        async with semaphore:
+            await bench.user_flow(
+                args.user_id_base + index,
+                vote_event_id,
+                options[index % len(options)],
+                workshop_event_id,
+                workshop_ids[index % len(workshop_ids)],
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(i) for i in range(args.users)))
+    duration = time.perf_counter() - started
+
+    if polling_task is not None:
+        dp.stop_polling()
+        await dp.wait_closed()
+        polling_task.cancel()
+    if webhook_runner is not None:
+        await webhook_runner.cleanup()
+    await bench.session.close()
+
+    updates = sum(len(values) for values in bench.samples.values())
+    result = {
+        "mode": args.mode,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "workshops": args.workshops,
+        "telegram_limits": args.telegram_limits,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "duration_s": round(duration, 3),
+        "updates": updates,
+        "timeouts": bench.errors,
+        "throughput_updates_per_s": round(updates / duration, 1) if duration else 0.0,
+        "throughput_users_per_s": round(args.users / duration, 1) if duration else 0.0,
+        "handlers": {name: summarize(values) for name, values in sorted(bench.samples.items())},
+        "end_to_end": {name: summarize(values) for name, values in sorted(bench.end_to_end.items())},
+        "end_to_end_all": summarize([v for values in bench.end_to_end.values() for v in values]),
+        "api_calls": dict(sorted(bench.api.calls.items())),
+        "db_write_stats": db.get_write_stats(),
+        "db_cache_stats": db.get_cache_stats(),
+        "send_queue": send_scheduler.get_stats(),
+        "queries_per_update": main.query_tracer.get_stats(),
+        "query_budget_violations": main.query_tracer.violations,
+    }
+
+    await main.on_shutdown(dp)
+    await main.storage.close()
+    await main.storage.wait_closed()
+    await bench.api.stop()
+    await (await bot.get_session()).close()
+    return result
+
+
+
+async def run_cluster(args, workers):
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+
+    import cluster
+    from event import EventDatabase
+
+    db = EventDatabase(os.environ["DB_NAME"])
+    vote_event_id, options, workshop_event_id, workshop_ids = await seed(db, args.users, args.workshops)
+    await db.close()
+
+    bench = Benchmark(None, "cluster")
+    await bench.api.start(args.host, args.api_port)
+    processes = cluster.start_workers(workers, args.host, args.cluster_port)
+    ingress = cluster.Ingress(workers, args.host, args.cluster_port, on_processed=bench.on_ack, processes=processes)
+    bot = Bot(BENCH_TOKEN, server=TelegramAPIServer.from_base(f"http://{args.host}:{args.api_port}"))
+    polling = None
+    try:
+        await ingress.connect()
+        polling = asyncio.create_task(ingress.poll(bot))
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one_user(index):
+            async with semaphore:
+                await bench.user_flow(
+                    args.user_id_base + index,
+                    vote_event_id,
+                    options[index % len(options)],
+                    workshop_event_id,
+                    workshop_ids[index % len(workshop_ids)],
+                )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_user(i) for i in range(args.users)))
+        duration = time.perf_counter() - started
+    finally:
+        if polling is not None:
+            ingress.stop_polling()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+        await ingress.close()
+        await asyncio.get_running_loop().run_in_executor(None, cluster.stop_workers, processes)
+        await (await bot.get_session()).close()
+        await bench.api.stop()
+
+    updates = sum(len(values) for values in bench.samples.values())
+    return {
+        "mode": "cluster",
+        "workers": workers,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "duration_s": round(duration, 3),
+        "updates": updates,
+        "timeouts": bench.errors,
+        "throughput_updates_per_s": round(updates / duration, 1) if duration else 0.0,
+        "throughput_users_per_s": round(args.users / duration, 1) if duration else 0.0,
+        "worker_processing": summarize(bench.samples["cluster"]),
+        "end_to_end_all": summarize(bench.end_to_end["cluster"]),
+        "routed_per_worker": ingress.get_stats()["routed"],
+        "restarts_per_worker": ingress.get_stats()["restarts"],
+        "lost_per_worker": ingress.get_stats()["lost"],
+        "api_calls": dict(sorted(bench.api.calls.items())),
+    }
+
+
+def print_scaling(results):
+    base = results[0]["throughput_updates_per_s"] or 1
+    print(f"\nПользователей: {results[0]['users']}, параллельно: {results[0]['concurrency']}\n")
+    print(f"{'воркеров':>9}{'апдейтов/с':>13}{'ускорение':>11}{'e2e p50':>10}{'e2e p95':>10}{'таймаутов':>11}")
+    for result in results:
+        e2e = result["end_to_end_all"]
+        print(f"{result['workers']:>9}{result['throughput_updates_per_s']:>13.1f}"
+              f"{result['throughput_updates_per_s'] / base:>10.2f}x{e2e['p50_ms']:>10.1f}{e2e['p95_ms']:>10.1f}"
+              f"{result['timeouts']:>11}")
+
+
+def print_report(result):
+    print(f"\nРежим: {result['mode']}, пользователей: {result['users']}, параллельно: {result['concurrency']}")
+    print(f"Время: {result['duration_s']} с, апдейтов: {result['updates']}, таймаутов: {result['timeouts']}")
+    print(f"Пропускная способность: {result['throughput_updates_per_s']} апдейтов/с, "
+          f"{result['throughput_users_per_s']} пользователей/с\n")
+    print(f"{'хендлер':<32}{'кол-во':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'e2e p95':>10}{'запросов':>10}")
+    for name, stats in result["handlers"].items():
+        e2e = result["end_to_end"].get(name, {})
+        queries = result["queries_per_update"].get(name, {})
+        print(f"{name:<32}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{e2e.get('p95_ms', 0):>10.2f}{queries.get('max_queries', 0):>10}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк бота с заглушкой Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="сколько синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=200, help="сколько пользователей действуют одновременно")
+    parser.add_argument("--workshops", type=int, default=20, help="мастер-классов в тестовом событии")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8181, help="порт заглушки Bot API")
+    parser.add_argument("--webhook-port", type=int, default=8182)
+    parser.add_argument("--user-id-base", type=int, default=10_000_000)
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="оставить лимиты отправки Telegram (по умолчанию сняты, меряем сам бот)")
+    parser.add_argument("--out", help="куда сохранить JSON (по умолчанию bench_results/<режим>-<время>.json)")
+    parser.add_argument("--strict-queries", action="store_true",
+                        help="превышение бюджета запросов на апдейт считается ошибкой прогона")
+    parser.add_argument("--keep-db", action="store_true", help="не удалять временные базы после прогона")
+    parser.add_argument("--workers", help="через cluster.py, по очереди для каждого числа воркеров: 1,2,4")
+    parser.add_argument("--cluster-port", type=int, default=8190, help="первый порт воркеров cluster.py")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Окружение задаём до импорта main.py: конфиг читается при импорте
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["DB_NAME"] = os.path.join(workdir, "events.db")
+    os.environ["FSM_DB_NAME"] = os.path.join(workdir, "fsm.db")
+    os.environ["METRICS_PORT"] = "0"
+    if args.strict_queries:
+        os.environ["QUERY_TRACE_STRICT"] = "1"
+    if not args.telegram_limits:
+        os.environ["SEND_GLOBAL_RATE"] = "1000000"
+        os.environ["SEND_CHAT_RATE"] = "1000000"
+        os.environ["SEND_CHAT_BURST"] = "1000000"
+
+    if args.workers:
+        return main_cluster(args, workdir)
+
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if args.keep_db:
+            print(f"Базы прогона: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    save_result(result, args.out or os.path.join("bench_results", f"{args.mode}-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+
+    if result["query_budget_violations"] and args.strict_queries:
+        print(f"Превышений бюджета запросов: {result['query_budget_violations']}")
+        return 1
+    return 0
+
+
+def main_cluster(args, workdir):
+    # Воркеры читают конфиг из окружения при старте, поэтому заглушку Bot API указываем через него
+    os.environ["BOT_API_SERVER"] = f"http://{args.host}:{args.api_port}"
+    results = []
+    try:
+        for workers in [int(value) for value in args.workers.split(",")]:
+            # У каждого прогона свои чистые базы
+            rundir = os.path.join(workdir, f"workers-{workers}")
+            os.makedirs(rundir)
+            os.environ["DB_NAME"] = os.path.join(rundir, "events.db")
+            os.environ["FSM_DB_NAME"] = os.path.join(rundir, "fsm.db")
+            results.append(asyncio.run(run_cluster(args, workers)))
+            print(f"{workers} воркер(ов): {results[-1]['throughput_updates_per_s']} апдейтов/с")
+    finally:
+        if args.keep_db:
+            print(f"Базы прогона: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_scaling(results)
+    save_result({"mode": "cluster", "runs": results},
+                args.out or os.path.join("bench_results", f"cluster-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    return 1 if any(result["timeouts"] for result in results) else 0
+
+
+def save_result(result, out):
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультат сохранён в {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
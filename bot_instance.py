@@ -2,8 +2,21 @@
 Это файлик чтобы не было цикличного импорта в мейне
 '''
 
-from aiogram import Bot
-from config import API_TOKEN
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 
-bot = Bot(token=API_TOKEN)
+from config import API_TOKEN, SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE_PER_MIN
+from config import BOT_API_SERVER
+from send_queue import QueuedBot, SendScheduler
 
+# Все отправки идут через общую очередь с лимитами Telegram
+send_scheduler = SendScheduler(
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    group_rate_per_min=SEND_GROUP_RATE_PER_MIN,
+)
+bot = QueuedBot(
+    token=API_TOKEN,
+    scheduler=send_scheduler,
+    server=TelegramAPIServer.from_base(BOT_API_SERVER) if BOT_API_SERVER else TELEGRAM_PRODUCTION,
+)
@@ -0,0 +1,143 @@
+'''
+Рассылка анонсов новых событий всем, кто писал боту.
+Прогресс сохраняется в базе после каждой страницы получателей,
+поэтому после перезапуска рассылка продолжается с того же места.
+'''
+
+import asyncio
+
+from aiohttp import ClientError
+from aiogram.utils.exceptions import (
+    BotBlocked, ChatNotFound, UserDeactivated, CantInitiateConversation, TelegramAPIError,
+)
+from aiogram.utils.markdown import quote_html
+
+import send_queue
+from bot_instance import bot
+from config import BROADCAST_RATE, BROADCAST_PAGE_SIZE, YOUR_ADMIN_ID
+from db_instance import db
+from send_queue import PRIORITY_BROADCAST
+
+
+# Ошибки, после которых писать пользователю бессмысленно
+UNREACHABLE_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated, CantInitiateConversation)
+
+DELIVERED = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+
+def event_announcement(event):
+    return (
+        f"📢 <b>Новое событие: {quote_html(event['event_name'])}</b>\n\n"
+        f"{quote_html(event['event_description'])}\n\n"
+        "Нажмите /start, чтобы принять участие."
+    )
+
+
+class Broadcaster:
+    def __init__(self, db, bot, rate=10.0, page_size=100, admin_id=None):
+        self.db = db
+        self.bot = bot
+        self.rate = rate  # сообщений в секунду; общий лимит бота дополнительно держит send_queue
+        self.page_size = page_size
+        self.admin_id = admin_id
+        self._tasks = {}  # broadcast_id -> asyncio.Task
+
+    # Возвращает номер новой рассылки или None, если по событию уже идёт рассылка
+    async def start(self, event_id, text):
+        broadcast_id = await self.db.create_broadcast(event_id, text)
+        if broadcast_id is not None:
+            self._launch(broadcast_id)
+        return broadcast_id
+
+    # Продолжает рассылки, прерванные перезапуском
+    async def resume(self):
+        for broadcast in await self.db.get_running_broadcasts():
+            print(f"Продолжаем рассылку {broadcast['broadcast_id']} после пользователя {broadcast['last_user_id']}")
+            self._launch(broadcast["broadcast_id"])
+
+    def _launch(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda task: self._on_done(broadcast_id, task))
+
+    def _on_done(self, broadcast_id, task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Статус остаётся running: рассылка продолжится при следующем запуске
+            print(f"Error in broadcast {broadcast_id}: {task.exception()}")
+
+    def running(self):
+        return list(self._tasks)
+
+    async def _deliver(self, user_id, text):
+        try:
+            await self.bot.send_message(user_id, text, parse_mode="HTML")
+            return DELIVERED
+        except UNREACHABLE_ERRORS:
+            return BLOCKED
+        except (TelegramAPIError, ClientError, asyncio.TimeoutError) as e:
+            # Сетевая ошибка — такая же неудача одной отправки, рассылка идёт дальше
+            print(f"Рассылка: не удалось отправить {user_id}: {e!r}")
+            return FAILED
+
+    async def _run(self, broadcast_id):
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        last_user_id = broadcast["last_user_id"]
+        counts = {DELIVERED: broadcast["sent"], BLOCKED: broadcast["blocked"], FAILED: broadcast["failed"]}
+
+        with send_queue.priority(PRIORITY_BROADCAST):
+            while True:
+                user_ids = await self.db.get_broadcast_recipients(last_user_id, self.page_size)
+                if not user_ids:
+                    break
+
+                # Равномерно запускаем отправки страницы, не отдавая рассылке весь лимит бота
+                tasks = []
+                for user_id in user_ids:
+                    tasks.append(asyncio.create_task(self._deliver(user_id, broadcast["text"])))
+                    await asyncio.sleep(1 / self.rate)
+                # return_exceptions: неожиданная ошибка одной отправки не бросает остальные задачи страницы
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+
+                blocked_ids = []
+                for user_id, result in zip(user_ids, results):
+                    if isinstance(result, Exception):
+                        print(f"Error in broadcast {broadcast_id} to {user_id}: {result!r}")
+                        result = FAILED
+                    counts[result] += 1
+                    if result == BLOCKED:
+                        blocked_ids.append(user_id)
+                last_user_id = user_ids[-1]
+                await self.db.save_broadcast_progress(
+                    broadcast_id, last_user_id, counts[DELIVERED], counts[BLOCKED], counts[FAILED],
+                    blocked_user_ids=blocked_ids,
+                )
+
+        await self.db.save_broadcast_progress(
+            broadcast_id, last_user_id, counts[DELIVERED], counts[BLOCKED], counts[FAILED], status="done",
+        )
+        print(f"Рассылка {broadcast_id} завершена: {counts}")
+
+        if self.admin_id:
+            await self.bot.send_message(
+                self.admin_id,
+                f"<b>Рассылка #{broadcast_id} завершена</b>\n"
+                f"Доставлено: {counts[DELIVERED]}\n"
+                f"Заблокировали бота: {counts[BLOCKED]}\n"
+                f"Ошибки: {counts[FAILED]}",
+                parse_mode="HTML",
+            )
+
+    # Останавливает рассылки при выключении бота; прогресс уже в базе
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+broadcaster = Broadcaster(db, bot, BROADCAST_RATE, BROADCAST_PAGE_SIZE, YOUR_ADMIN_ID)
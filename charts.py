@@ -0,0 +1,172 @@
+'''
+Рендер графиков голосований в пуле процессов,
+чтобы отрисовка не блокировала обработку апдейтов
+'''
+
+import asyncio
+import io
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from config import CHART_WORKERS, CHART_QUEUE_SIZE, CHART_TIMEOUT, CHART_CACHE_SIZE
+
+
+# Уникальные цвета для столбцов графика
+COLORS = [
+    "#FF5733",  # Красный
+    "#33FF57",  # Зеленый
+    "#3357FF",  # Синий
+    "#FF33A8",  # Розовый
+    "#8A33FF",  # Фиолетовый
+    "#33FFF3",  # Бирюзовый
+    "#FF8A33",  # Оранжевый
+    "#FFCC00",  # Желтый
+    "#F0E68C",  # Хаки
+    "#D2691E",  # Шоколадный
+    "#9932CC",  # Темно-фиолетовый
+    "#FF6347",  # Томатный
+    "#ADFF2F",  # Зелёный с лимонным оттенком
+    "#FF1493",  # Дикий розовый
+    "#FF4500",  # Оранжево-красный
+    "#20B2AA",  # Светло-бирюзовый
+    "#800080",  # Пурпурный
+    "#FFD700",  # Золотой
+    "#2F4F4F",  # Темно-серый
+    "#800000",  # Бардовый
+]
+
+
+class ChartBusyError(Exception):
+    """Очередь на отрисовку заполнена"""
+
+
+def render_vote_chart(options, counts, percentages):
+    """
+    Рисует столбчатую диаграмму результатов и возвращает PNG в байтах.
+    Выполняется в дочернем процессе; используется объектный API Figure,
+    без глобального состояния pyplot.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    colors = (COLORS * (len(options) // len(COLORS) + 1))[:len(options)]
+    bars = ax.bar(options, counts, color=colors, edgecolor="black")
+
+    for bar, percentage in zip(bars, percentages):
+        y_position = bar.get_height() / 2 if bar.get_height() > 0 else 0.2
+        ax.text(
+            bar.get_x() + bar.get_width() / 2,
+            y_position,
+            f"{percentage:.1f}%",
+            ha="center",
+            va="center",
+            fontsize=10,
+            color="black",
+            weight="bold"
+        )
+
+    ax.set_title("Результаты голосования", fontsize=16, weight="bold")
+    ax.set_xlabel("Варианты", fontsize=12, weight="bold")
+    ax.set_ylabel("Количество голосов", fontsize=12, weight="bold")
+    ax.tick_params(axis="x", labelsize=10)
+    for label in ax.get_xticklabels():
+        label.set_rotation(30)
+        label.set_horizontalalignment("right")
+    ax.grid(axis="y", linestyle="--", alpha=0.7)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    def __init__(self, workers=2, queue_size=8, timeout=20.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self._executor
+
+    def start(self):
+        """
+        Запускает процессы-рендереры. Вызывается при старте бота до подключения
+        к базе: fork делается, пока в процессе ещё нет потоков aiosqlite
+        """
+        self._get_executor().submit(int).result()
+
+    async def render_vote_chart(self, options, counts, percentages):
+        # Ограничиваем очередь: лишние запросы сразу получают отказ, а не копятся
+        if self._pending >= self.queue_size:
+            raise ChartBusyError()
+        loop = asyncio.get_running_loop()
+        job = self._get_executor().submit(render_vote_chart, options, counts, percentages)
+        # Место в очереди освобождает сама задача пула, когда она действительно закончилась:
+        # после таймаута рендер ещё идёт в процессе и должен учитываться в queue_size
+        self._pending += 1
+        job.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+
+    # Колбэк задачи пула вызывается в его служебном потоке — счётчик меняем в цикле событий
+    def _release(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._decrement)
+        except RuntimeError:
+            pass  # цикл уже закрыт при остановке бота
+
+    def _decrement(self):
+        self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class ChartCache:
+    """
+    Готовые графики по ключу (event_id, отпечаток счётчиков голосов).
+    Кроме PNG хранится file_id, который вернул Telegram после первой отправки:
+    повторный показ тех же результатов не загружает картинку заново.
+    """
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, event_id, fingerprint):
+        entry = self._entries.get((event_id, fingerprint))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end((event_id, fingerprint))
+        return entry
+
+    def put(self, event_id, fingerprint, png, file_id=None):
+        # Голоса изменились — графики этого события с другим отпечатком больше не нужны
+        for key in [key for key in self._entries if key[0] == event_id and key[1] != fingerprint]:
+            del self._entries[key]
+        self._entries[(event_id, fingerprint)] = {"png": png, "file_id": file_id}
+        self._entries.move_to_end((event_id, fingerprint))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+renderer = ChartRenderer(CHART_WORKERS, CHART_QUEUE_SIZE, CHART_TIMEOUT)
+chart_cache = ChartCache(CHART_CACHE_SIZE)
@@ -0,0 +1,475 @@
+'''
+Режим нескольких процессов.
+
+Один процесс (ingress) получает апдейты — long polling или вебхук — и раздаёт
+их по хэшу user_id между N воркерами. Каждый воркер — отдельный процесс
+с полным диспетчером из main.py. Апдейты одного пользователя всегда попадают
+в один воркер и обрабатываются там строго по очереди, поэтому состояние FSM,
+кэш участия и лимиты личного чата остаются внутри одного процесса.
+
+База у всех общая. SQLite работает в режиме WAL с busy_timeout, а кэш каталога
+сверяется с catalog_version (DB_CATALOG_CHECK_INTERVAL). Рассылки и плановые
+бэкапы ведёт только воркер 0. Общий лимит отправки делится между воркерами поровну.
+
+    python cluster.py --workers 4
+'''
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import time
+import zlib
+
+from aiohttp import web
+
+from config import (
+    CLUSTER_WORKERS, CLUSTER_HOST, CLUSTER_PORT, BOT_MODE, METRICS_PORT, SEND_GLOBAL_RATE,
+    DB_CATALOG_CHECK_INTERVAL, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Поля апдейта, в которых лежит автор (или чат, если автора нет)
+USER_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "callback_query",
+    "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def update_user_id(update):
+    """user_id автора сырого апдейта (словаря из Bot API); None, если автора нет"""
+    for field in USER_FIELDS:
+        obj = update.get(field)
+        if obj:
+            user = obj.get("from") or obj.get("chat")
+            return user["id"] if user else None
+    poll_answer = update.get("poll_answer")
+    if poll_answer and poll_answer.get("user"):
+        return poll_answer["user"]["id"]
+    return None
+
+
+def shard_for(user_id, workers):
+    if user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+class ShardWorker:
+    """
+    Принимает апдейты от ingress построчно (JSON) и прогоняет через диспетчер.
+    Разные пользователи обрабатываются параллельно, один пользователь — по очереди.
+    На каждый обработанный апдейт ingress получает подтверждение
+    """
+
+    def __init__(self, dp):
+        self.dp = dp
+        self._chains = {}  # user_id -> задача последнего апдейта пользователя
+        self.processed = 0
+
+    async def serve(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self._submit(json.loads(line), writer)
+
+    def _submit(self, raw, writer):
+        key = update_user_id(raw)
+        task = asyncio.create_task(self._process(raw, self._chains.get(key), writer))
+        self._chains[key] = task
+        task.add_done_callback(lambda task: self._chains.pop(key) if self._chains.get(key) is task else None)
+
+    async def _process(self, raw, previous, writer):
+        from aiogram import types
+
+        if previous is not None:
+            await asyncio.wait([previous])
+        started = time.perf_counter()
+        try:
+            await self.dp.updates_handler.notify(types.Update(**raw))
+        except Exception as e:
+            print(f"Error in worker update {raw.get('update_id')}: {e}")
+        self.processed += 1
+        ack = {"update_id": raw.get("update_id"), "ms": round((time.perf_counter() - started) * 1000, 3)}
+        if not writer.is_closing():
+            writer.write(json.dumps(ack).encode() + b"\n")
+
+    # Ждёт, пока допишутся уже принятые апдейты
+    async def drain(self):
+        while self._chains:
+            await asyncio.wait(list(self._chains.values()))
+
+
+async def _worker_main(index, host, port):
+    # main.py импортируется уже в процессе воркера: конфиг читает окружение, заданное cluster.py
+    import main
+    from aiogram import Bot, Dispatcher
+
+    dp = main.dp
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await main.on_start(dp)
+
+    worker = ShardWorker(dp)
+    server = await asyncio.start_server(worker.serve, host, port)
+    print(f"Воркер {index} (pid {os.getpid()}) принимает апдейты на {host}:{port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    server.close()
+    await worker.drain()
+    await main.on_shutdown(dp)
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    await (await dp.bot.get_session()).close()
+    print(f"Воркер {index} остановлен, обработано апдейтов: {worker.processed}")
+
+
+def run_worker(index, host, port):
+    asyncio.run(_worker_main(index, host, port))
+
+
+def worker_env(index, workers):
+    """Окружение воркера: свой номер, свой порт метрик, доля общего лимита отправки"""
+    return {
+        "CLUSTER_WORKER_INDEX": str(index),
+        "METRICS_PORT": str(METRICS_PORT + index if METRICS_PORT else 0),
+        "SEND_GLOBAL_RATE": str(SEND_GLOBAL_RATE / workers),
+        "DB_CATALOG_CHECK_INTERVAL": str(DB_CATALOG_CHECK_INTERVAL or 1),
+    }
+
+
+def start_worker(index, workers, host=CLUSTER_HOST, port=CLUSTER_PORT):
+    # spawn: воркер стартует с чистым интерпретатором и читает конфиг из своего окружения
+    context = multiprocessing.get_context("spawn")
+    saved = dict(os.environ)
+    try:
+        os.environ.update(worker_env(index, workers))
+        process = context.Process(target=run_worker, args=(index, host, port + index), name=f"worker-{index}")
+        process.start()
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return process
+
+
+def start_workers(workers, host=CLUSTER_HOST, port=CLUSTER_PORT):
+    return [start_worker(index, workers, host, port) for index in range(workers)]
+
+
+def stop_workers(processes, timeout=30):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()  # SIGTERM: воркер дописывает принятые апдейты и закрывает базу
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+
+
+class Ingress:
+    """
+    Получает апдейты и раздаёт их воркерам shard_for(user_id).
+
+    У каждого воркера своя очередь и своя задача отправки, поэтому недоступный
+    воркер задерживает только своих пользователей: их апдейты копятся в его очереди
+    (до queue_size) и уходят, когда воркер снова подключится. Порядок апдейтов
+    внутри очереди сохраняется, а значит, и для пользователя.
+
+    Упавший воркер ingress перезапускает (когда знает processes). Апдейты, которые
+    воркер уже получил, но не подтвердил, заново не отправляются: хендлер мог успеть
+    выполниться наполовину, а повтор создания события, рассылки или шага FSM
+    опаснее потери одного нажатия (at-most-once). Их число пишется в лог
+    """
+
+    def __init__(self, workers, host=CLUSTER_HOST, port=CLUSTER_PORT, on_processed=None, processes=None,
+                 queue_size=1000, connect_timeout=120, max_restarts=5):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.on_processed = on_processed  # вызывается с подтверждением воркера
+        self.processes = processes  # процессы воркеров из start_workers; упавший перезапускается
+        self.connect_timeout = connect_timeout
+        self.max_restarts = max_restarts  # сколько раз подряд воркер может упасть, не успев подключиться
+        self.routed = [0] * workers
+        self.restarts = [0] * workers
+        self.lost = [0] * workers  # получены упавшим воркером, но не подтверждены
+        self.failed = asyncio.Event()  # воркер не поднимается — ingress надо останавливать
+        self._queues = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self._writers = [None] * workers
+        self._ready = [asyncio.Event() for _ in range(workers)]
+        self._pending = [{} for _ in range(workers)]  # update_id -> апдейт, отправлен без подтверждения
+        self._crashes = [0] * workers
+        self._ack_tasks = [None] * workers
+        self._send_tasks = [None] * workers
+        self._reconnect_tasks = [None] * workers
+        self._watch_task = None
+        self._polling = False
+
+    @staticmethod
+    def _encode(update):
+        return json.dumps(update, ensure_ascii=False).encode() + b"\n"
+
+    # Подключается ко всем воркерам; они поднимают сокет только после on_start
+    async def connect(self):
+        for index in range(self.workers):
+            await self._connect(index)
+            self._send_tasks[index] = asyncio.create_task(self._send_loop(index))
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def _connect(self, index):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port + index)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        if self._pending[index]:
+            self.lost[index] += len(self._pending[index])
+            print(f"WARNING: воркер {index} не подтвердил {len(self._pending[index])} апдейтов, "
+                  "они не повторяются")
+            self._pending[index].clear()
+        self._writers[index] = writer
+        self._ack_tasks[index] = asyncio.create_task(self._read_acks(index, reader))
+        self._crashes[index] = 0
+        self._ready[index].set()
+
+    async def _reconnect(self, index):
+        try:
+            await self._connect(index)
+        except OSError as e:
+            print(f"Error in worker {index} reconnect: {e}")
+
+    # Соединение с воркером потеряно: его очередь ждёт переподключения
+    def _disconnect(self, index):
+        self._ready[index].clear()
+        writer, self._writers[index] = self._writers[index], None
+        if writer is not None:
+            writer.close()
+
+    async def _read_acks(self, index, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                ack = json.loads(line)
+                self._pending[index].pop(ack.get("update_id"), None)
+                if self.on_processed is not None:
+                    self.on_processed(ack)
+        except ConnectionError:
+            pass
+        print(f"WARNING: воркер {index} закрыл соединение")
+        self._disconnect(index)
+
+    # Отправляет апдейты из очереди воркера по одному, пока он подключён
+    async def _send_loop(self, index):
+        queue = self._queues[index]
+        while True:
+            update = await queue.get()
+            while True:
+                await self._ready[index].wait()
+                writer = self._writers[index]
+                update_id = update["update_id"]
+                self._pending[index][update_id] = update
+                try:
+                    writer.write(self._encode(update))
+                    await writer.drain()
+                    break
+                except ConnectionError:
+                    # До воркера апдейт не дошёл — отправим после переподключения
+                    self._pending[index].pop(update_id, None)
+                    self._disconnect(index)
+            self.routed[index] += 1
+            queue.task_done()
+
+    # Следит за процессами воркеров: упавший перезапускает, потерянное соединение восстанавливает.
+    # Переподключение к каждому воркеру — отдельная задача: медленный старт одного
+    # не мешает заметить падение другого
+    async def _watch(self, interval=0.5):
+        while True:
+            await asyncio.sleep(interval)
+            for index in range(self.workers):
+                process = self.processes[index] if self.processes else None
+                # Код 0 — воркер остановлен сигналом намеренно, его не поднимаем
+                if process is not None and not process.is_alive() and process.exitcode != 0:
+                    self._disconnect(index)
+                    reconnect = self._reconnect_tasks[index]
+                    if reconnect is not None:
+                        reconnect.cancel()
+                        self._reconnect_tasks[index] = None
+                    self._crashes[index] += 1
+                    if self._crashes[index] > self.max_restarts:
+                        print(f"Error in worker {index}: падает при каждом запуске, останавливаем ingress")
+                        self.failed.set()
+                        return
+                    print(f"WARNING: воркер {index} упал (код {process.exitcode}), перезапускаем")
+                    process = self.processes[index] = start_worker(index, self.workers, self.host, self.port)
+                    self.restarts[index] += 1
+                if self._ready[index].is_set() or (process is not None and not process.is_alive()):
+                    continue
+                reconnect = self._reconnect_tasks[index]
+                if reconnect is None or reconnect.done():
+                    self._reconnect_tasks[index] = asyncio.create_task(self._reconnect(index))
+
+    def route(self, update):
+        """
+        Ставит апдейт в очередь его воркера. Если очередь переполнена (воркер
+        давно недоступен), бросает ConnectionError — апдейт не принят
+        """
+        index = shard_for(update_user_id(update), self.workers)
+        try:
+            self._queues[index].put_nowait(update)
+        except asyncio.QueueFull:
+            raise ConnectionError(f"очередь воркера {index} переполнена") from None
+
+    async def poll(self, bot, timeout=20, limit=100):
+        """Long polling: getUpdates в цикле, апдейты сразу раздаются по очередям воркеров"""
+        self._polling = True
+        offset = None
+        while self._polling:
+            payload = {"timeout": timeout, "limit": limit}
+            if offset is not None:
+                payload["offset"] = offset
+            try:
+                updates = await bot.request("getUpdates", payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                try:
+                    self.route(update)
+                except ConnectionError as e:
+                    # offset не двигаем: этот апдейт и следующие придут в новом getUpdates
+                    print(f"Error in route update {update['update_id']}: {e}")
+                    await asyncio.sleep(1)
+                    break
+                offset = update["update_id"] + 1
+
+    def stop_polling(self):
+        self._polling = False
+
+    def webhook_app(self, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        async def handle(request):
+            if secret and request.headers.get(SECRET_HEADER) != secret:
+                raise web.HTTPForbidden()
+            try:
+                self.route(await request.json())
+            except ConnectionError as e:
+                print(f"Error in route webhook update: {e}")
+                raise web.HTTPServiceUnavailable()  # Telegram повторит доставку
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        return app
+
+    def get_stats(self):
+        return {
+            "routed": list(self.routed),
+            "queued": [queue.qsize() for queue in self._queues],
+            "in_flight": [len(pending) for pending in self._pending],
+            "restarts": list(self.restarts),
+            "lost": list(self.lost),
+        }
+
+    # Ждёт, пока очереди уйдут воркерам (перед остановкой)
+    async def drain(self, timeout=10):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            print(f"WARNING: не отправлены воркерам апдейты: {[queue.qsize() for queue in self._queues]}")
+
+    async def close(self):
+        tasks = [
+            task for task in [self._watch_task] + self._send_tasks + self._reconnect_tasks + self._ack_tasks
+            if task is not None
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for index in range(self.workers):
+            self._disconnect(index)
+        self._watch_task = None
+        self._ack_tasks = [None] * self.workers
+        self._send_tasks = [None] * self.workers
+        self._reconnect_tasks = [None] * self.workers
+
+
+async def run_ingress(workers, mode, processes=None):
+    from bot_instance import bot
+
+    ingress = Ingress(workers, processes=processes)
+    await ingress.connect()
+    print(f"Ingress: {workers} воркеров, режим {mode}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = None
+    polling = None
+    if mode == "webhook":
+        runner = web.AppRunner(ingress.webhook_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        await bot.set_webhook(f"{WEBHOOK_HOST}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+    else:
+        await bot.delete_webhook()
+        polling = asyncio.create_task(ingress.poll(bot))
+
+    # Останавливаемся по сигналу или если воркер не удаётся поднять
+    waiters = [asyncio.create_task(stop.wait()), asyncio.create_task(ingress.failed.wait())]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    for waiter in waiters:
+        waiter.cancel()
+
+    if polling is not None:
+        ingress.stop_polling()
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+    if runner is not None:
+        await bot.delete_webhook()
+        await runner.cleanup()
+    await ingress.drain()
+    await ingress.close()
+    await (await bot.get_session()).close()
+    return not ingress.failed.is_set()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот на нескольких процессах с раздачей апдейтов по user_id")
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=BOT_MODE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    processes = start_workers(args.workers)
+    try:
+        ok = asyncio.run(run_ingress(args.workers, args.mode, processes))
+    finally:
+        stop_workers(processes)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
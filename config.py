@@ -11,4 +11,76 @@ API_TOKEN = os.getenv("BOT_TOKEN")
 # if not API_TOKEN:
 #     raise ValueError("BOT_TOKEN не найден в переменных окружения!")
 
-YOUR_ADMIN_ID = 1012078689 
\ No newline at end of file
+YOUR_ADMIN_ID = 1012078689 
+
+# Настройки базы данных
+DB_NAME = os.getenv("DB_NAME", "events.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))  # сколько соединений только на чтение
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # OFF / NORMAL / FULL
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))  # отрицательное значение = KiB
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+PARTICIPATION_CACHE_SIZE = int(os.getenv("PARTICIPATION_CACHE_SIZE", "50000"))  # пользователей в LRU
+RESPONSE_BATCH_SIZE = int(os.getenv("RESPONSE_BATCH_SIZE", "200"))  # голосов в одной транзакции
+RESPONSE_BATCH_DELAY_MS = float(os.getenv("RESPONSE_BATCH_DELAY_MS", "5"))  # сколько ждать добора пачки
+DB_CATALOG_CHECK_INTERVAL = float(os.getenv("DB_CATALOG_CHECK_INTERVAL", "0"))  # секунд; >0, если базу пишут несколько процессов
+
+# Рендер графиков в отдельных процессах
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", "8"))  # сколько графиков может ждать одновременно
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "20"))  # секунд на один график
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "64"))  # готовых графиков в памяти
+
+# Хранилище состояний FSM
+FSM_DB_NAME = os.getenv("FSM_DB_NAME", "fsm.db")
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # пользователей в памяти
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "24"))  # брошенные состояния удаляются
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))  # секунд между записями на диск
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # придёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+# Лимиты исходящих сообщений (ограничения Telegram)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # сообщений в секунду на весь бот
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # сообщений в секунду в один личный чат
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))  # сколько можно отправить в чат подряд без паузы
+SEND_GROUP_RATE_PER_MIN = float(os.getenv("SEND_GROUP_RATE_PER_MIN", "20"))
+
+# Рассылка анонсов новых событий
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "10"))  # сообщений в секунду
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "100"))  # получателей между сохранениями прогресса
+
+# Метрики Prometheus на локальном порту (0 — выключены)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Счётчик запросов на апдейт (поиск N+1)
+QUERY_TRACE_MAX_QUERIES = int(os.getenv("QUERY_TRACE_MAX_QUERIES", "15"))  # запросов на один апдейт
+QUERY_TRACE_MAX_ROWS = int(os.getenv("QUERY_TRACE_MAX_ROWS", "500"))  # прочитанных строк на один апдейт
+QUERY_TRACE_MAX_REPEATS = int(os.getenv("QUERY_TRACE_MAX_REPEATS", "4"))  # повторов одного запроса
+QUERY_TRACE_STRICT = os.getenv("QUERY_TRACE_STRICT", "0") == "1"  # превышение — исключение (для прогонов)
+
+# Отчёты: выгрузка файлом и просмотр по страницам
+OPEN_VOTE_PAGE_SIZE = int(os.getenv("OPEN_VOTE_PAGE_SIZE", "10"))  # ответов открытого голосования на странице
+OPEN_VOTE_TEXT_LIMIT = int(os.getenv("OPEN_VOTE_TEXT_LIMIT", "300"))  # длинные ответы обрезаются, целиком — в выгрузке
+OPEN_VOTE_DESCRIPTION_LIMIT = int(os.getenv("OPEN_VOTE_DESCRIPTION_LIMIT", "1000"))  # описание события в шапке страницы
+MESSAGE_LIMIT = 4096  # символов в одном сообщении Telegram
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))  # результатов поиска по ответам на странице
+
+# Резервные копии базы (online backup API SQLite)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))  # 0 — без плановых копий
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))  # сколько копий хранить: отдельно плановых и ручных
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))  # страниц базы за один шаг копирования
+BACKUP_VERIFY = os.getenv("BACKUP_VERIFY", "1") == "1"  # PRAGMA integrity_check на копии
+
+# Несколько процессов-обработчиков (cluster.py)
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "4"))
+CLUSTER_HOST = os.getenv("CLUSTER_HOST", "127.0.0.1")
+CLUSTER_PORT = int(os.getenv("CLUSTER_PORT", "8300"))  # воркер i слушает CLUSTER_PORT + i
+CLUSTER_WORKER_INDEX = int(os.getenv("CLUSTER_WORKER_INDEX", "0"))  # задаёт cluster.py; у воркера 0 — фоновые задачи
+BOT_API_SERVER = os.getenv("BOT_API_SERVER", "")  # свой сервер Bot API, например http://localhost:8081
@@ -0,0 +1,22 @@
+'''
+Единственный экземпляр базы на весь процесс (как bot_instance.py для бота),
+чтобы хэндлеры и main.py работали через один пул соединений
+'''
+
+from config import (
+    DB_NAME, DB_READERS, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE,
+    PARTICIPATION_CACHE_SIZE, RESPONSE_BATCH_SIZE, RESPONSE_BATCH_DELAY_MS, DB_CATALOG_CHECK_INTERVAL,
+)
+from event import EventDatabase
+
+db = EventDatabase(
+    DB_NAME,
+    readers=DB_READERS,
+    synchronous=DB_SYNCHRONOUS,
+    cache_size=DB_CACHE_SIZE,
+    mmap_size=DB_MMAP_SIZE,
+    participation_cache_size=PARTICIPATION_CACHE_SIZE,
+    batch_size=RESPONSE_BATCH_SIZE,
+    batch_delay=RESPONSE_BATCH_DELAY_MS / 1000,
+    catalog_check_interval=DB_CATALOG_CHECK_INTERVAL,
+)
@@ -0,0 +1,100 @@
+'''
+Соединение aiosqlite, которое сообщает хукам о каждом SQL-запросе:
+имя (метод EventDatabase, из которого он вызван), время выполнения и число прочитанных строк
+'''
+
+import os
+import sqlite3
+import sys
+import time
+
+import aiosqlite
+from aiosqlite.context import contextmanager
+
+_AIOSQLITE_DIR = os.path.dirname(aiosqlite.__file__)
+
+
+def _caller_name():
+    # Первый кадр вне этого модуля и aiosqlite — это метод, выполняющий запрос
+    frame = sys._getframe(2)
+    while frame is not None and (frame.f_code.co_filename == __file__
+                                 or frame.f_code.co_filename.startswith(_AIOSQLITE_DIR)):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "unknown"
+
+
+def statement_kind(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+
+class TracedCursor(aiosqlite.Cursor):
+    def __init__(self, conn, cursor, hooks):
+        super().__init__(conn, cursor)
+        self._hooks = hooks
+        self._name = None
+
+    async def _traced(self, method, sql, parameters, many=False):
+        if not self._hooks:
+            return await method(sql, parameters)
+        self._name = _caller_name()
+        started = time.perf_counter()
+        try:
+            return await method(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - started
+            for hook in self._hooks:
+                hook.on_execute(self._name, sql, seconds, many)
+
+    async def execute(self, sql, parameters=None):
+        return await self._traced(super().execute, sql, parameters)
+
+    async def executemany(self, sql, parameters):
+        return await self._traced(super().executemany, sql, parameters, many=True)
+
+    def _fetched(self, count):
+        if self._hooks and count:
+            for hook in self._hooks:
+                hook.on_fetch(self._name or _caller_name(), count)
+
+    async def fetchone(self):
+        row = await super().fetchone()
+        self._fetched(1 if row is not None else 0)
+        return row
+
+    async def fetchmany(self, size=None):
+        rows = await super().fetchmany(size)
+        self._fetched(len(rows))
+        return rows
+
+    async def fetchall(self):
+        rows = await super().fetchall()
+        self._fetched(len(rows))
+        return rows
+
+
+class TracedConnection(aiosqlite.Connection):
+    def __init__(self, connector, iter_chunk_size, hooks):
+        super().__init__(connector, iter_chunk_size)
+        self.hooks = hooks
+
+    @contextmanager
+    async def cursor(self):
+        return TracedCursor(self, await self._execute(self._conn.cursor), self.hooks)
+
+    @contextmanager
+    async def execute(self, sql, parameters=None):
+        cursor = TracedCursor(self, await self._execute(self._conn.cursor), self.hooks)
+        await cursor.execute(sql, parameters)
+        return cursor
+
+
+def connect(database, hooks, iter_chunk_size=64, **kwargs):
+    """
+    Как aiosqlite.connect, но с хуками. hooks — общий список объектов
+    с методами on_execute(name, sql, seconds, many) и on_fetch(name, rows);
+    его можно пополнять после подключения
+    """
+    def connector():
+        return sqlite3.connect(str(database), **kwargs)
+
+    return TracedConnection(connector, iter_chunk_size, hooks)
@@ -2,149 +2,696 @@
 Класс для работы с бд
 '''
 
-import aiosqlite
+import asyncio
+import time
+from collections import OrderedDict
+
+import db_trace
+
+# Результаты записи на мастер-класс
+REGISTRATION_OK = "ok"
+REGISTRATION_ALREADY = "already_registered"
+REGISTRATION_FULL = "full"
+REGISTRATION_NOT_FOUND = "not_found"
+
+# Пересчёт vote_tallies из responses (миграция и команда /rebuild_tallies)
+TALLY_REBUILD_SQL = """
+    INSERT INTO vote_tallies (option_id, event_id, vote_count)
+    SELECT eo.option_id, eo.event_id, COUNT(r.response_id)
+    FROM event_options eo
+    LEFT JOIN responses r ON r.option_id = eo.option_id
+    GROUP BY eo.option_id
+"""
+
+# Миграции схемы: (версия, список SQL). Применяются по порядку в connect(),
+# номер последней применённой миграции хранится в PRAGMA user_version.
+# Вместо SQL можно указать пару (SQL, подпись): число изменённых строк попадёт в лог.
+# Уже выпущенные миграции не меняем — только добавляем новые в конец.
+MIGRATIONS = [
+    # 1: исходные таблицы (IF NOT EXISTS — база, созданная до миграций, проходит без изменений)
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_name TEXT NOT NULL,
+            event_description TEXT NOT NULL,
+            event_type TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS event_options (
+            option_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            option_text TEXT NOT NULL,
+            FOREIGN KEY(event_id) REFERENCES events(event_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS workshops (
+            workshop_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            workshop_name TEXT NOT NULL,
+            workshop_description TEXT NOT NULL,
+            instructor TEXT NOT NULL,
+            max_participants INTEGER NOT NULL,
+            current_participants INTEGER DEFAULT 0,
+            FOREIGN KEY(event_id) REFERENCES events(event_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            user_id INTEGER,
+            user_name TEXT,
+            option_id INTEGER,
+            custom_text TEXT,
+            response_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(event_id) REFERENCES events(event_id),
+            FOREIGN KEY(option_id) REFERENCES event_options(option_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS workshop_registrations (
+            registration_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            workshop_id INTEGER,
+            user_id INTEGER,
+            user_name TEXT,
+            group_number TEXT,
+            registration_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(workshop_id) REFERENCES workshops(workshop_id)
+        );
+        """,
+    ]),
+    # 2: индексы под горячие выборки
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_responses_user_event ON responses(user_id, event_id)",
+        "CREATE INDEX IF NOT EXISTS idx_responses_option ON responses(option_id)",
+        "CREATE INDEX IF NOT EXISTS idx_registrations_user_workshop ON workshop_registrations(user_id, workshop_id)",
+        "CREATE INDEX IF NOT EXISTS idx_registrations_workshop ON workshop_registrations(workshop_id)",
+        "CREATE INDEX IF NOT EXISTS idx_workshops_event ON workshops(event_id)",
+        "CREATE INDEX IF NOT EXISTS idx_event_options_event ON event_options(event_id)",
+    ]),
+    # 3: счётчики голосов по вариантам, обновляются вместе со вставкой ответа
+    (3, [
+        """
+        CREATE TABLE IF NOT EXISTS vote_tallies (
+            option_id INTEGER PRIMARY KEY,
+            event_id INTEGER NOT NULL,
+            vote_count INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_vote_tallies_event ON vote_tallies(event_id)",
+        TALLY_REBUILD_SQL,
+    ]),
+    # 4: все, кто писал боту, и рассылки о новых событиях с сохранённым прогрессом
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            username TEXT,
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_blocked INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            FOREIGN KEY(event_id) REFERENCES events(event_id)
+        );
+        """,
+    ]),
+    # 5: сводка по событиям группирует ответы по event_id и считает уникальных пользователей по индексу
+    (5, [
+        "CREATE INDEX IF NOT EXISTS idx_responses_event_user ON responses(event_id, user_id)",
+    ]),
+    # 6: полнотекстовый поиск по текстам ответов; индекс ведут триггеры на responses
+    (6, [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS responses_fts USING fts5(
+            custom_text,
+            content='responses',
+            content_rowid='response_id'
+        );
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS responses_fts_insert AFTER INSERT ON responses BEGIN
+            INSERT INTO responses_fts(rowid, custom_text) VALUES (new.response_id, new.custom_text);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS responses_fts_delete AFTER DELETE ON responses BEGIN
+            INSERT INTO responses_fts(responses_fts, rowid, custom_text) VALUES ('delete', old.response_id, old.custom_text);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS responses_fts_update AFTER UPDATE OF custom_text ON responses BEGIN
+            INSERT INTO responses_fts(responses_fts, rowid, custom_text) VALUES ('delete', old.response_id, old.custom_text);
+            INSERT INTO responses_fts(rowid, custom_text) VALUES (new.response_id, new.custom_text);
+        END;
+        """,
+        # Индексирует ответы, собранные до миграции
+        "INSERT INTO responses_fts(responses_fts) VALUES ('rebuild')",
+    ]),
+    # 7: постраничный просмотр ответов по ключу (response_time, response_id) без сортировки всей выборки
+    (7, [
+        "CREATE INDEX IF NOT EXISTS idx_responses_event_time ON responses(event_id, response_time, response_id)",
+    ]),
+    # 8: номер версии каталога. Триггеры увеличивают его при любом изменении событий,
+    # вариантов и мастер-классов, так другие процессы (cluster.py) узнают, что их кэш устарел
+    (8, [
+        """
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        "INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)",
+        """
+        CREATE TRIGGER IF NOT EXISTS events_catalog_insert AFTER INSERT ON events BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS events_catalog_delete AFTER DELETE ON events BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS events_catalog_update AFTER UPDATE OF event_name, event_description, event_type ON events BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS event_options_catalog_insert AFTER INSERT ON event_options BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS event_options_catalog_delete AFTER DELETE ON event_options BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS event_options_catalog_update AFTER UPDATE OF event_id, option_text ON event_options BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS workshops_catalog_insert AFTER INSERT ON workshops BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS workshops_catalog_delete AFTER DELETE ON workshops BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS workshops_catalog_update AFTER UPDATE OF event_id, workshop_name ON workshops BEGIN
+            UPDATE catalog_version SET version = version + 1;
+        END;
+        """,
+    ]),
+    # 9: один ответ на событие и одна запись на мастер-класс от пользователя — на уровне базы.
+    # Дубли от двойных нажатий, попавшие в базу раньше, удаляем (остаётся первая строка),
+    # затем пересчитываем счётчики. Уникальные индексы заменяют прежние неуникальные
+    (9, [
+        ("""
+        DELETE FROM responses WHERE response_id NOT IN (
+            SELECT MIN(response_id) FROM responses GROUP BY event_id, user_id
+        )
+        """, "удалено дублей в responses"),
+        "DROP INDEX IF EXISTS idx_responses_event_user",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_event_user ON responses(event_id, user_id)",
+        "DELETE FROM vote_tallies",
+        TALLY_REBUILD_SQL,
+        ("""
+        DELETE FROM workshop_registrations WHERE registration_id NOT IN (
+            SELECT MIN(registration_id) FROM workshop_registrations GROUP BY workshop_id, user_id
+        )
+        """, "удалено дублей в workshop_registrations"),
+        "DROP INDEX IF EXISTS idx_registrations_workshop",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_workshop_user ON workshop_registrations(workshop_id, user_id)",
+        """
+        UPDATE workshops SET current_participants = (
+            SELECT COUNT(*) FROM workshop_registrations wr WHERE wr.workshop_id = workshops.workshop_id
+        )
+        """,
+    ]),
+]
+
+# Маркеры совпадений в сниппете поиска; в HTML их превращает хендлер после экранирования текста
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+# Превращает ввод админа в запрос FTS5: каждое слово ищется как префикс, все слова обязательны.
+# Слова берутся в кавычки, поэтому операторы FTS5 (AND, NEAR, *) в вводе не ломают запрос
+def fts_query(text):
+    words = [word.replace('"', "") for word in text.split()]
+    return " ".join(f'"{word}"*' for word in words if word)
+
 
 class EventDatabase:
-    def __init__(self, db_name="events.db"):
+    """
+    Пул соединений с базой: одно соединение на запись (self.con) и
+    несколько соединений только для чтения. База работает в режиме WAL,
+    поэтому чтения не ждут, пока пишущее соединение закоммитит транзакцию.
+    """
+
+    def __init__(self, db_name="events.db", readers=4, synchronous="NORMAL",
+                 cache_size=-16000, mmap_size=64 * 1024 * 1024, busy_timeout=5000,
+                 participation_cache_size=50000, batch_size=200, batch_delay=0.005,
+                 users_flush_interval=1.0, users_touch_interval=600, catalog_check_interval=0):
         self.db_name = db_name
         self.con = None
+        self.readers = []
+        self.reader_count = readers if db_name != ":memory:" else 0
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self._next_reader = 0
+        # Каталог событий (события, варианты, мастер-классы) в памяти.
+        # Меняется только админом, поэтому сбрасывается при каждой его записи
+        self._catalog = None
+        self._catalog_generation = 0
+        # Если базу меняют другие процессы (cluster.py), раз в catalog_check_interval секунд
+        # сверяем номер версии каталога в базе; 0 — один процесс, проверка не нужна
+        self.catalog_check_interval = catalog_check_interval
+        self._catalog_checked = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # user_id -> множество event_id, в которых пользователь участвовал
+        self._participation = OrderedDict()
+        self._participation_loading = {}
+        self.participation_cache_size = participation_cache_size
+        # Групповой коммит ответов: голоса копятся в очереди и пишутся
+        # одной транзакцией раз в batch_delay секунд или по batch_size штук
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._response_queue = None
+        self._response_writer_task = None
+        self.write_stats = {
+            "batches": 0,
+            "rows": 0,
+            "duplicates": 0,  # повторные ответы, отсечённые уникальным индексом
+            "max_batch": 0,
+            "last_batch": 0,
+            "last_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+        }
+        # Реестр пользователей: апдейты только отмечают пользователя в памяти,
+        # на диск пачка уходит раз в users_flush_interval секунд.
+        # Один и тот же пользователь пишется не чаще раза в users_touch_interval секунд
+        self.users_flush_interval = users_flush_interval
+        self.users_touch_interval = users_touch_interval
+        self._pending_users = {}
+        self._users_touched = OrderedDict()
+        self._users_flush_task = None
+        # Хуки на каждый SQL-запрос (метрики, трассировка), см. db_trace.py
+        self.query_hooks = []
+        self._connect_lock = asyncio.Lock()
+        # Одна транзакция на соединение за раз: корутины не должны смешивать BEGIN/COMMIT
+        self._write_lock = asyncio.Lock()
 
     # Метод для подключения к базе данных
     async def connect(self):
-        if self.con is None:
-            self.con = await aiosqlite.connect(self.db_name)
-            await self.create_tables()
+        async with self._connect_lock:
+            if self.con is None:
+                con = await db_trace.connect(self.db_name, self.query_hooks)
+                await con.execute("PRAGMA journal_mode=WAL")
+                await self._apply_pragmas(con)
+                self.con = con
+                await self.create_tables()
+
+                for _ in range(self.reader_count):
+                    reader = await db_trace.connect(self.db_name, self.query_hooks)
+                    await self._apply_pragmas(reader)
+                    await reader.execute("PRAGMA query_only=ON")
+                    self.readers.append(reader)
+
+                await self.load_catalog()
 
-    # Создание таблиц, если они не существуют
+                self._response_queue = asyncio.Queue()
+                self._response_writer_task = asyncio.create_task(self._response_writer())
+                self._users_flush_task = asyncio.create_task(self._users_flusher())
+
+    async def _apply_pragmas(self, con):
+        await con.execute(f"PRAGMA synchronous={self.synchronous}")
+        await con.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        await con.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        await con.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+
+    def add_query_hook(self, hook):
+        """
+        hook получает on_execute(name, sql, seconds, many) на каждый запрос
+        и on_fetch(name, rows) на каждую выборку; name — метод базы, выполнивший запрос
+        """
+        self.query_hooks.append(hook)
+
+    # Соединение для чтения (по кругу); без пула читаем через пишущее соединение
+    def _reader(self):
+        if not self.readers:
+            return self.con
+        reader = self.readers[self._next_reader]
+        self._next_reader = (self._next_reader + 1) % len(self.readers)
+        return reader
+
+    # Переносит содержимое WAL в основной файл базы
+    async def checkpoint(self):
+        await self.connect()
+        async with self._write_lock:
+            await self.con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def close(self):
+        async with self._connect_lock:
+            if self._response_writer_task is not None:
+                # Дописываем всё, что уже стоит в очереди
+                await self._response_queue.join()
+                self._response_writer_task.cancel()
+                self._response_writer_task = None
+                self._response_queue = None
+            if self._users_flush_task is not None:
+                self._users_flush_task.cancel()
+                self._users_flush_task = None
+                await self.flush_users()
+            for reader in self.readers:
+                await reader.close()
+            self.readers = []
+            if self.con is not None:
+                await self.con.close()
+                self.con = None
+
+    # Фоновая задача группового коммита ответов
+    async def _response_writer(self):
+        queue = self._response_queue
+        while True:
+            batch = [await queue.get()]
+            try:
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if len(batch) < self.batch_size and self.batch_delay > 0:
+                    await asyncio.sleep(self.batch_delay)
+                    while len(batch) < self.batch_size and not queue.empty():
+                        batch.append(queue.get_nowait())
+
+                try:
+                    await self._write_responses(batch)
+                except Exception as e:
+                    print(f"Error in response batch of {len(batch)}: {e}")
+                    # Одна плохая строка не должна ронять чужие голоса — пишем по одной
+                    for item in batch:
+                        try:
+                            await self._write_responses([item])
+                        except Exception as item_error:
+                            if not item[1].done():
+                                item[1].set_exception(item_error)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write_responses(self, batch):
+        started = time.perf_counter()
+        response_ids = []
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    # Повторный ответ (двойное нажатие) отсекает уникальный индекс (event_id, user_id):
+                    # строка не вставляется, rowcount = 0, а в response_ids попадает None
+                    for (event_id, user_id, user_name, option_id, custom_text), _ in batch:
+                        await cursor.execute("""
+                            INSERT INTO responses (event_id, user_id, user_name, option_id, custom_text)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(event_id, user_id) DO NOTHING
+                        """, (event_id, user_id, user_name, option_id, custom_text or None))
+                        response_ids.append(cursor.lastrowid if cursor.rowcount else None)
+
+                    # Счётчики обновляем в той же транзакции, по одному UPSERT на вариант
+                    tallies = {}
+                    for ((event_id, _, _, option_id, _), _), response_id in zip(batch, response_ids):
+                        if response_id is None:
+                            continue
+                        key = (option_id, event_id)
+                        tallies[key] = tallies.get(key, 0) + 1
+                    await cursor.executemany("""
+                        INSERT INTO vote_tallies (option_id, event_id, vote_count)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(option_id) DO UPDATE SET vote_count = vote_count + excluded.vote_count
+                    """, [(option_id, event_id, count) for (option_id, event_id), count in tallies.items()])
+                await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+        commit_ms = (time.perf_counter() - started) * 1000
+
+        stats = self.write_stats
+        stats["batches"] += 1
+        stats["rows"] += len(batch)
+        stats["duplicates"] += response_ids.count(None)
+        stats["max_batch"] = max(stats["max_batch"], len(batch))
+        stats["last_batch"] = len(batch)
+        stats["last_commit_ms"] = commit_ms
+        stats["total_commit_ms"] += commit_ms
+
+        # Голос считается принятым только после коммита его пачки
+        for ((event_id, user_id, *_), future), response_id in zip(batch, response_ids):
+            self._mark_participated(user_id, event_id)
+            if not future.done():
+                future.set_result(response_id)
+
+    # Ставит ответ в очередь и ждёт коммита пачки, в которую он попал
+    async def _enqueue_response(self, event_id, user_id, user_name, option_id, custom_text=None):
+        await self.connect()
+        future = asyncio.get_running_loop().create_future()
+        self._response_queue.put_nowait(((event_id, user_id, user_name, option_id, custom_text), future))
+        return await future
+
+    def get_write_stats(self):
+        stats = dict(self.write_stats)
+        stats["avg_batch"] = stats["rows"] / stats["batches"] if stats["batches"] else 0
+        stats["avg_commit_ms"] = stats["total_commit_ms"] / stats["batches"] if stats["batches"] else 0
+        stats["queue_depth"] = self._response_queue.qsize() if self._response_queue else 0
+        return stats
+
+    # Применяет недостающие миграции схемы
     async def create_tables(self):
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS events (
-                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_name TEXT NOT NULL,
-                    event_description TEXT NOT NULL,
-                    event_type TEXT NOT NULL
-                );
-            """)
-            await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS event_options (
-                    option_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_id INTEGER,
-                    option_text TEXT NOT NULL,
-                    FOREIGN KEY(event_id) REFERENCES events(event_id)
-                );
-            """)
-            await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workshops (
-                    workshop_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_id INTEGER,
-                    workshop_name TEXT NOT NULL,
-                    workshop_description TEXT NOT NULL,
-                    instructor TEXT NOT NULL,
-                    max_participants INTEGER NOT NULL,
-                    current_participants INTEGER DEFAULT 0,
-                    FOREIGN KEY(event_id) REFERENCES events(event_id)
-                );
-            """)
-            await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS responses (
-                    response_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_id INTEGER,
-                    user_id INTEGER,
-                    user_name TEXT,
-                    option_id INTEGER,
-                    custom_text TEXT,
-                    response_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(event_id) REFERENCES events(event_id),
-                    FOREIGN KEY(option_id) REFERENCES event_options(option_id)
-                );
-            """)
+        async with self.con.execute("PRAGMA user_version") as cursor:
+            current_version = (await cursor.fetchone())[0]
+
+        for version, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            # Каждая миграция — отдельная транзакция: при ошибке база остаётся на прошлой версии
+            async with self.con.cursor() as cursor:
+                try:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    # Несколько процессов (cluster.py) стартуют одновременно: версию
+                    # перечитываем под блокировкой записи, миграцию применяет только первый
+                    await cursor.execute("PRAGMA user_version")
+                    if (await cursor.fetchone())[0] >= version:
+                        await self.con.rollback()
+                        continue
+                    report = []
+                    for statement in statements:
+                        label = None
+                        if isinstance(statement, tuple):
+                            statement, label = statement
+                        await cursor.execute(statement)
+                        if label:
+                            await cursor.execute("SELECT changes()")
+                            report.append(f"{label}: {(await cursor.fetchone())[0]}")
+                    await cursor.execute(f"PRAGMA user_version = {int(version)}")
+                    await self.con.commit()
+                except Exception:
+                    await self.con.rollback()
+                    raise
+            print(f"База данных обновлена до версии {version}")
+            for line in report:
+                print(f"  Миграция {version}: {line}")
+
+    # Загружает каталог событий из базы целиком
+    async def load_catalog(self):
+        generation = self._catalog_generation
+        con = self._reader()
+        events = {}
+        options = {}
+        workshops = {}
+        workshop_events = {}
+        async with con.cursor() as cursor:
+            # Версия читается до таблиц: если каталог поменяют во время загрузки, следующая сверка это заметит
+            await cursor.execute("SELECT version FROM catalog_version")
+            version = (await cursor.fetchone())[0]
+
             await cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workshop_registrations (
-                    registration_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    workshop_id INTEGER,
-                    user_id INTEGER,
-                    user_name TEXT,
-                    group_number TEXT,
-                    registration_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(workshop_id) REFERENCES workshops(workshop_id)
-                );
+                SELECT event_id, event_name, event_description, event_type
+                FROM events
+                ORDER BY event_id
             """)
-            await self.con.commit()
+            for row in await cursor.fetchall():
+                events[row[0]] = {
+                    "event_id": row[0],
+                    "event_name": row[1],
+                    "event_description": row[2],
+                    "event_type": row[3],
+                }
+                options[row[0]] = []
+                workshops[row[0]] = []
+
+            await cursor.execute("SELECT option_id, event_id, option_text FROM event_options ORDER BY option_id")
+            for row in await cursor.fetchall():
+                options.setdefault(row[1], []).append({"option_id": row[0], "option_text": row[2]})
+
+            await cursor.execute("SELECT workshop_id, event_id, workshop_name FROM workshops ORDER BY workshop_id")
+            for row in await cursor.fetchall():
+                workshops.setdefault(row[1], []).append({"workshop_id": row[0], "workshop_name": row[2]})
+                workshop_events[row[0]] = row[1]
+
+        catalog = {
+            "events": events, "options": options, "workshops": workshops,
+            "workshop_events": workshop_events, "version": version,
+        }
+        # Если за время загрузки админ что-то поменял, такой каталог уже устарел
+        if generation == self._catalog_generation:
+            self._catalog = catalog
+        return catalog
+
+    async def _get_catalog(self):
+        await self.connect()
+        if self._catalog is not None and self.catalog_check_interval:
+            now = time.monotonic()
+            if now - self._catalog_checked >= self.catalog_check_interval:
+                self._catalog_checked = now
+                async with self._reader().execute("SELECT version FROM catalog_version") as cursor:
+                    version = (await cursor.fetchone())[0]
+                if version != self._catalog["version"]:
+                    self._invalidate_catalog()
+        if self._catalog is not None:
+            self.cache_hits += 1
+            return self._catalog
+        self.cache_misses += 1
+        return await self.load_catalog()
+
+    # Сбрасывает каталог после изменения событий, вариантов или мастер-классов
+    def _invalidate_catalog(self):
+        self._catalog = None
+        self._catalog_generation += 1
+
+    def get_cache_stats(self):
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "loaded": self._catalog is not None,
+        }
 
     # Метод для добавления события
     async def add_event(self, event_name, event_description, event_type):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                INSERT INTO events (event_name, event_description, event_type)
-                VALUES (?, ?, ?)
-            """, (event_name, event_description, event_type))
-            await self.con.commit()
+        async with self._write_lock:
+            async with self.con.cursor() as cursor:
+                await cursor.execute("""
+                    INSERT INTO events (event_name, event_description, event_type)
+                    VALUES (?, ?, ?)
+                """, (event_name, event_description, event_type))
+                await self.con.commit()
+            self._invalidate_catalog()
 
     # Метод для добавления варианта ответа для события
     async def add_option(self, event_id, option_text):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                INSERT INTO event_options (event_id, option_text)
-                VALUES (?, ?)
-            """, (event_id, option_text))
-            await self.con.commit()
+        async with self._write_lock:
+            async with self.con.cursor() as cursor:
+                await cursor.execute("""
+                    INSERT INTO event_options (event_id, option_text)
+                    VALUES (?, ?)
+                """, (event_id, option_text))
+                await self.con.commit()
+            self._invalidate_catalog()
+
+    # Добавляет несколько вариантов ответа одной транзакцией
+    async def add_options(self, event_id, option_texts):
+        await self.connect()
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    await cursor.executemany("""
+                        INSERT INTO event_options (event_id, option_text)
+                        VALUES (?, ?)
+                    """, [(event_id, option_text) for option_text in option_texts])
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+            self._invalidate_catalog()
 
     # Получаем все события
     async def get_all_events(self):
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                SELECT event_id, event_name, event_description, event_type
-                FROM events
-            """)
-            rows = await cursor.fetchall()
-            return [
-                {
-                    "event_id": row[0],
-                    "event_name": row[1],
-                    "event_description": row[2],
-                    "event_type": row[3],
-                }
-                for row in rows
-            ]
+        catalog = await self._get_catalog()
+        return [dict(event) for event in catalog["events"].values()]
 
     # Получаем событие по ID
     async def get_event_by_id(self, event_id):
-        await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("SELECT event_id, event_name, event_description, event_type FROM events WHERE event_id = ?", (event_id,))
-            event = await cursor.fetchone()
-            if event:
-                return {"event_id": event[0], "event_name": event[1], "event_description": event[2], "event_type": event[3]}
-            return None
+        catalog = await self._get_catalog()
+        event = catalog["events"].get(event_id)
+        return dict(event) if event else None
 
     # Получаем варианты для голосования
     async def get_event_options(self, event_id):
-        await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("SELECT option_id, option_text FROM event_options WHERE event_id = ?", (event_id,))
-            options = await cursor.fetchall()
-            return [{"option_id": option[0], "option_text": option[1]} for option in options]
+        catalog = await self._get_catalog()
+        return [dict(option) for option in catalog["options"].get(event_id, [])]
 
     async def get_event_id_by_name(self, event_name):
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            await cursor.execute("SELECT event_id FROM events WHERE event_name = ?", (event_name,))
-            result = await cursor.fetchone()
-            return result[0] if result else None
+        catalog = await self._get_catalog()
+        for event in catalog["events"].values():
+            if event["event_name"] == event_name:
+                return event["event_id"]
+        return None
 
 
     async def add_workshop(self, event_id, workshop_name, workshop_description, instructor, max_participants):
         await self.connect()
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                INSERT INTO workshops (event_id, workshop_name, workshop_description, instructor, max_participants)
-                VALUES (?, ?, ?, ?, ?)
-            """, (event_id, workshop_name, workshop_description, instructor, max_participants))
-            await self.con.commit()
+        async with self._write_lock:
+            async with self.con.cursor() as cursor:
+                await cursor.execute("""
+                    INSERT INTO workshops (event_id, workshop_name, workshop_description, instructor, max_participants)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (event_id, workshop_name, workshop_description, instructor, max_participants))
+                await self.con.commit()
+            self._invalidate_catalog()
+
+    # Добавляет много мастер-классов одной транзакцией (импорт из Excel)
+    async def add_workshops(self, event_id, workshops):
+        """
+        workshops: список кортежей (workshop_name, workshop_description, instructor, max_participants)
+        """
+        await self.connect()
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    await cursor.executemany("""
+                        INSERT INTO workshops (event_id, workshop_name, workshop_description, instructor, max_participants)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, [(event_id, *workshop) for workshop in workshops])
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+            self._invalidate_catalog()
 
     # async def add_response(self, event_id, user_id, user_name, option_id):
     #     await self.connect()
@@ -168,73 +715,31 @@ class EventDatabase:
         """
         Добавляет ответ на голосование.
         Если передан custom_text, сохраняет его вместе с ответом.
+        Возвращает управление только после коммита (ответы пишутся пачками).
+        Возвращает response_id новой строки или None, если пользователь уже отвечал.
         """
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            if custom_text:
-                await cursor.execute("""
-                    INSERT INTO responses (event_id, user_id, user_name, option_id, custom_text)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (event_id, user_id, user_name, option_id, custom_text))
-            else:
-                await cursor.execute("""
-                    INSERT INTO responses (event_id, user_id, user_name, option_id)
-                    VALUES (?, ?, ?, ?)
-                """, (event_id, user_id, user_name, option_id))
-            await self.con.commit()
+        return await self._enqueue_response(event_id, user_id, user_name, option_id, custom_text)
 
     # Получаем мастер-классы по событию
     async def get_workshops_by_event(self, event_id):
-        await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("SELECT workshop_id, workshop_name FROM workshops WHERE event_id = ?", (event_id,))
-            workshops = await cursor.fetchall()
-            return [{"workshop_id": workshop[0], "workshop_name": workshop[1]} for workshop in workshops]
+        catalog = await self._get_catalog()
+        return [dict(workshop) for workshop in catalog["workshops"].get(event_id, [])]
 
     # Регистрируем пользователя на мастер-класс
     async def register_for_workshop(self, workshop_id, user_id, user_name, group_number):
-        await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            # Получаем текущие данные мастер-класса
-            await cursor.execute("SELECT max_participants, current_participants FROM workshops WHERE workshop_id = ?", (workshop_id,))
-            workshop = await cursor.fetchone()
-
-            if workshop:
-                max_participants, current_participants = workshop
-                # Проверяем, что не превышен лимит участников
-                if current_participants >= max_participants:
-                    return False  # Мастер-класс переполнен
-
-                # Добавляем пользователя в таблицу workshop_registrations
-                await cursor.execute("""
-                    INSERT INTO workshop_registrations (workshop_id, user_id, user_name, group_number)
-                    VALUES (?, ?, ?, ?)
-                """, (workshop_id, user_id, user_name, group_number))
-                await self.con.commit()
-
-                # Обновляем количество участников мастер-класса
-                new_participant_count = current_participants + 1
-                await cursor.execute("""
-                    UPDATE workshops
-                    SET current_participants = ?
-                    WHERE workshop_id = ?
-                """, (new_participant_count, workshop_id))
-                await self.con.commit()
-
-                return True  # Успешная регистрация
-            else:
-                return False  # Мастер-класс не найден
+        result = await self.register_user_for_workshop(user_id, workshop_id, user_name, group_number)
+        return result == REGISTRATION_OK
 
     # Проверка регистрации пользователя на мастер-классе
     async def is_user_registered_for_workshop(self, user_id, workshop_id):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("SELECT 1 FROM workshop_registrations WHERE user_id = ? AND workshop_id = ?", (user_id, workshop_id))
             return await cursor.fetchone() is not None
 
     async def is_user_registered_for_event(self, user_id: int, event_id: int) -> bool:
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute(
                 """
                 SELECT 1
@@ -248,7 +753,7 @@ class EventDatabase:
 
     async def get_workshop_by_id(self, workshop_id: int):
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT workshop_id, workshop_name, workshop_description, instructor, max_participants, current_participants
                 FROM workshops
@@ -268,59 +773,73 @@ class EventDatabase:
 
     async def delete_event(self, event_id):
         await self.connect()
-        async with self.con.cursor() as cursor:
-            # Удаляем связанные данные
-            await cursor.execute("DELETE FROM responses WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM event_options WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM workshops WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
-            await self.con.commit()
-
-    async def register_user_for_workshop(self, user_id: int, workshop_id: int, participant_name: str, group_number: str):
-        try:
-            # Получаем текущие данные мастер-класса
-            await self.connect()
+        async with self._write_lock:
             async with self.con.cursor() as cursor:
-                await cursor.execute("SELECT max_participants, current_participants FROM workshops WHERE workshop_id = ?", (workshop_id,))
-                workshop = await cursor.fetchone()
-
-            if workshop:
-                max_participants, current_participants = workshop
-                # Проверяем, что не превышен лимит участников
-                if current_participants >= max_participants:
-                    return False  # Мастер-класс переполнен
+                # Удаляем связанные данные
+                await cursor.execute("DELETE FROM responses WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM event_options WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM vote_tallies WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM workshops WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
+                await self.con.commit()
+            self._invalidate_catalog()
 
-                # Добавляем пользователя в таблицу workshop_registrations
+    async def register_user_for_workshop(self, user_id: int, workshop_id: int, participant_name: str, group_number: str):
+        """
+        Атомарно бронирует место на мастер-классе.
+        Вставка регистрации (дубль отсекает уникальный индекс) и условное увеличение
+        счётчика выполняются в одной транзакции, поэтому при одновременных нажатиях
+        «Записаться» мест не может быть продано больше, чем max_participants.
+        Возвращает REGISTRATION_OK, REGISTRATION_ALREADY, REGISTRATION_FULL
+        или REGISTRATION_NOT_FOUND.
+        """
+        await self.connect()
+        async with self._write_lock:
+            try:
                 async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+
+                    # Дубль отсекает уникальный индекс (workshop_id, user_id), отдельная проверка не нужна
                     await cursor.execute("""
                         INSERT INTO workshop_registrations (workshop_id, user_id, user_name, group_number)
                         VALUES (?, ?, ?, ?)
+                        ON CONFLICT(workshop_id, user_id) DO NOTHING
                     """, (workshop_id, user_id, participant_name, group_number))
-                    await self.con.commit()
+                    if cursor.rowcount == 0:
+                        await self.con.rollback()
+                        return REGISTRATION_ALREADY
 
-                # Обновляем количество участников мастер-класса
-                new_participant_count = current_participants + 1
-                async with self.con.cursor() as cursor:
+                    # Место занимается только если оно ещё есть, иначе откатываем и вставку
                     await cursor.execute("""
                         UPDATE workshops
-                        SET current_participants = ?
-                        WHERE workshop_id = ?
-                    """, (new_participant_count, workshop_id))
+                        SET current_participants = current_participants + 1
+                        WHERE workshop_id = ? AND current_participants < max_participants
+                    """, (workshop_id,))
+                    if cursor.rowcount == 0:
+                        await cursor.execute("SELECT 1 FROM workshops WHERE workshop_id = ?", (workshop_id,))
+                        exists = await cursor.fetchone() is not None
+                        await self.con.rollback()
+                        return REGISTRATION_FULL if exists else REGISTRATION_NOT_FOUND
+
                     await self.con.commit()
 
-                return True  # Успешная регистрация
-            else:
-                return False  # Мастер-класс не найден
+            except Exception as e:
+                print(f"Error during registration: {e}")
+                await self.con.rollback()
+                raise
 
-        except Exception as e:
-            print(f"Error during registration: {e}")
-            return False
+        # Запись уже сохранена: ошибка при обновлении кэша не должна её откатывать
+        catalog = await self._get_catalog()
+        event_id = catalog["workshop_events"].get(workshop_id)
+        if event_id is not None:
+            self._mark_participated(user_id, event_id)
+        return REGISTRATION_OK
 
     async def is_user_registered_for_any_workshop(self, user_id: int):
         try:
             # Выполним запрос на проверку, зарегистрирован ли пользователь на любом мастер-классе
             await self.connect()
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 await cursor.execute("""
                     SELECT COUNT(*) FROM workshop_registrations WHERE user_id = ?
                 """, (user_id,))
@@ -333,17 +852,20 @@ class EventDatabase:
     # Удаляем событие и связанные данные
     async def delete_event(self, event_id):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("DELETE FROM responses WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM event_options WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM workshops WHERE event_id = ?", (event_id,))
-            await cursor.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
-            await self.con.commit()
+        async with self._write_lock:
+            async with self.con.cursor() as cursor:
+                await cursor.execute("DELETE FROM responses WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM event_options WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM vote_tallies WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM workshops WHERE event_id = ?", (event_id,))
+                await cursor.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
+                await self.con.commit()
+            self._invalidate_catalog()
 
     # Получаем список участников для мастер-класса
     async def get_workshop_participants(self, workshop_id):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT wr.user_name, wr.group_number
                 FROM workshop_registrations wr
@@ -355,7 +877,7 @@ class EventDatabase:
     # Проверка, голосовал ли пользователь на событие
     async def has_user_voted(self, user_id, event_id):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT 1 FROM responses WHERE user_id = ? AND event_id = ?
             """, (user_id, event_id))
@@ -364,30 +886,31 @@ class EventDatabase:
     # Получаем результаты голосования для события
     async def get_vote_results(self, event_id):
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
-                SELECT eo.option_text, COUNT(r.response_id) AS vote_count
+                SELECT eo.option_text, COALESCE(t.vote_count, 0) AS vote_count
                 FROM event_options eo
-                LEFT JOIN responses r ON eo.option_id = r.option_id
+                LEFT JOIN vote_tallies t ON t.option_id = eo.option_id
                 WHERE eo.event_id = ?
-                GROUP BY eo.option_id
+                ORDER BY eo.option_id
             """, (event_id,))
             rows = await cursor.fetchall()
             return [{"option_text": row[0], "vote_count": row[1]} for row in rows]
 
     # Получаем события, которые являются голосованиями
     async def get_vote_events(self):
-        await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
-            await cursor.execute("SELECT event_id, event_name FROM events WHERE event_type='vote'")
-            rows = await cursor.fetchall()
-            return [{'event_id': row[0], 'event_name': row[1]} for row in rows]
+        catalog = await self._get_catalog()
+        return [
+            {'event_id': event['event_id'], 'event_name': event['event_name']}
+            for event in catalog["events"].values()
+            if event['event_type'] == 'vote'
+        ]
 
     # Проверка, голосовал ли пользователь на событие
     async def has_user_voted(self, user_id: int, event_id: int) -> bool:
         await self.connect()  # Подключаемся, если еще не подключены
         try:
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 await cursor.execute("""
                     SELECT 1 FROM responses
                     WHERE user_id = ? AND event_id = ?
@@ -401,13 +924,13 @@ class EventDatabase:
     async def get_vote_results(self, event_id: int):
         await self.connect()  # Подключаемся, если еще не подключены
         try:
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 await cursor.execute("""
-                    SELECT eo.option_text, COUNT(r.response_id) AS vote_count
+                    SELECT eo.option_text, COALESCE(t.vote_count, 0) AS vote_count
                     FROM event_options eo
-                    LEFT JOIN responses r ON eo.option_id = r.option_id
+                    LEFT JOIN vote_tallies t ON t.option_id = eo.option_id
                     WHERE eo.event_id = ?
-                    GROUP BY eo.option_id
+                    ORDER BY eo.option_id
                 """, (event_id,))
                 rows = await cursor.fetchall()
                 return [{"option_text": row[0], "vote_count": row[1]} for row in rows]
@@ -415,11 +938,25 @@ class EventDatabase:
             print(f"Error in get_vote_results: {e}")
             return []
 
+    # Пересчитывает vote_tallies из responses (на случай ручных правок базы)
+    async def rebuild_vote_tallies(self):
+        await self.connect()
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    await cursor.execute("DELETE FROM vote_tallies")
+                    await cursor.execute(TALLY_REBUILD_SQL)
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+
     # Получаем участников мастер-класса
     async def get_workshop_participants(self, workshop_id: int):
         await self.connect()  # Подключаемся, если еще не подключены
         try:
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 await cursor.execute("""
                     SELECT wr.user_name, wr.group_number
                     FROM workshop_registrations wr
@@ -435,7 +972,7 @@ class EventDatabase:
     async def get_workshops_with_participants(self, event_id):
         await self.connect()  # Подключаемся, если еще не подключены
         try:
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 print(f"DEBUG: Выполняется запрос для event_id {event_id}")
                 await cursor.execute("""
                     SELECT 
@@ -469,7 +1006,7 @@ class EventDatabase:
     async def get_participants_by_groups(self, event_id):
         await self.connect()  # Подключаемся, если еще не подключены
         try:
-            async with self.con.cursor() as cursor:
+            async with self._reader().cursor() as cursor:
                 print(f"DEBUG: Выполняется запрос для event_id {event_id} по отрядам")
                 await cursor.execute("""
                     SELECT 
@@ -500,24 +1037,65 @@ class EventDatabase:
 
 # Получаем список событий, в которых пользователь уже участвовал (голосовал или зарегистрировался на мастер-классе)
     async def get_user_participated_event_ids(self, user_id: int):
-        # Получаем события, в которых пользователь проголосовал
-        voted_events = await self.get_voted_event_ids(user_id)
-        # Получаем события, на которые пользователь зарегистрировался (мастер-классы)
-        registered_events = await self.get_registered_event_ids(user_id)
+        return list(await self._get_participation(user_id))
+
+    # Записан ли пользователь на мастер-класс того же события (одна запись на событие).
+    # Отвечает из кэша каталога и кэша участия, обычно без запроса к базе
+    async def is_user_registered_for_workshop_event(self, user_id: int, workshop_id: int) -> bool:
+        catalog = await self._get_catalog()
+        event_id = catalog["workshop_events"].get(workshop_id)
+        return event_id is not None and event_id in await self._get_participation(user_id)
 
-        # Объединяем события и удаляем дубликаты
-        return list(set(voted_events + registered_events))
+    # Множество event_id, в которых участвовал пользователь.
+    # Держим в памяти для последних participation_cache_size пользователей (LRU),
+    # после загрузки оно обновляется при каждом голосе и записи на мастер-класс
+    async def _get_participation(self, user_id: int):
+        participated = self._participation.get(user_id)
+        if participated is not None:
+            self._participation.move_to_end(user_id)
+            return participated
 
+        # Пока идёт загрузка, новые голоса пользователя копятся в pending
+        pending = set()
+        self._participation_loading.setdefault(user_id, []).append(pending)
+        try:
+            # Получаем события, в которых пользователь проголосовал
+            voted_events = await self.get_voted_event_ids(user_id)
+            # Получаем события, на которые пользователь зарегистрировался (мастер-классы)
+            registered_events = await self.get_registered_event_ids(user_id)
+        finally:
+            loading = self._participation_loading[user_id]
+            loading.remove(pending)
+            if not loading:
+                del self._participation_loading[user_id]
+
+        participated = self._participation.get(user_id)
+        if participated is None:
+            participated = set(voted_events) | set(registered_events)
+            self._participation[user_id] = participated
+            while len(self._participation) > self.participation_cache_size:
+                self._participation.popitem(last=False)
+        participated |= pending
+        return participated
+
+    # Отмечает участие пользователя в событии в кэше
+    def _mark_participated(self, user_id: int, event_id):
+        participated = self._participation.get(user_id)
+        if participated is not None:
+            participated.add(event_id)
+        for pending in self._participation_loading.get(user_id, []):
+            pending.add(event_id)
 
     # Получаем список event_id для событий, в которых пользователь проголосовал
 # Получаем список event_id для событий, в которых пользователь проголосовал
     async def get_voted_event_ids(self, user_id: int):
+        await self.connect()
         query = """
             SELECT event_id
             FROM responses
             WHERE user_id = ?
         """
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute(query, (user_id,))
             rows = await cursor.fetchall()
         return [row[0] for row in rows]
@@ -526,13 +1104,14 @@ class EventDatabase:
     # Получаем список event_id для событий, на которые пользователь зарегистрировался
 # Получаем список event_id для событий, на которые пользователь зарегистрировался (мастер-классы)
     async def get_registered_event_ids(self, user_id: int):
+        await self.connect()
         query = """
             SELECT w.event_id
             FROM workshop_registrations wr
             JOIN workshops w ON wr.workshop_id = w.workshop_id
             WHERE wr.user_id = ?
         """
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute(query, (user_id,))
             rows = await cursor.fetchall()
         return [row[0] for row in rows]
@@ -541,20 +1120,23 @@ class EventDatabase:
     # Получаем список будущих событий, в которых пользователь еще не участвовал
 # Получаем список будущих событий, в которых пользователь еще не участвовал
     async def get_upcoming_events(self, user_id: int):
-        # Получаем все события
-        events = await self.get_all_events()
-        # Получаем события, в которых пользователь уже участвовал
-        participated_event_ids = await self.get_user_participated_event_ids(user_id)
+        # Все события берём из каталога в памяти
+        catalog = await self._get_catalog()
+        # События, в которых пользователь уже участвовал
+        participated_event_ids = await self._get_participation(user_id)
         # Фильтруем только те события, в которых пользователь еще не участвовал
-        upcoming_events = [event for event in events if event['event_id'] not in participated_event_ids]
-        return upcoming_events
+        return [
+            dict(event)
+            for event_id, event in catalog["events"].items()
+            if event_id not in participated_event_ids
+        ]
 
     async def get_available_slots_for_workshop(self, workshop_id):
         """
         Возвращает количество доступных мест на мастер-классе.
         """
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT max_participants - current_participants
                 FROM workshops
@@ -571,7 +1153,7 @@ class EventDatabase:
         Возвращает мастер-классы для указанного события, у которых есть свободные места.
         """
         await self.connect()  # Подключаемся, если еще не подключены
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT 
                     workshop_id, 
@@ -595,26 +1177,14 @@ class EventDatabase:
         """
         Добавляет ответ пользователя с возможностью указания текста.
         """
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            if custom_text:
-                await cursor.execute("""
-                    INSERT INTO responses (event_id, user_id, user_name, option_id, custom_text)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (event_id, user_id, user_name, option_id, custom_text))
-            else:
-                await cursor.execute("""
-                    INSERT INTO responses (event_id, user_id, user_name, option_id)
-                    VALUES (?, ?, ?, ?)
-                """, (event_id, user_id, user_name, option_id))
-            await self.con.commit()
+        return await self._enqueue_response(event_id, user_id, user_name, option_id, custom_text)
     
     async def get_open_vote_responses(self, event_id: int):
         """
         Получает все текстовые ответы для открытого голосования.
         """
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT r.user_name, r.custom_text, r.response_time
                 FROM responses r
@@ -634,66 +1204,42 @@ class EventDatabase:
     
     async def get_event_options(self, event_id: int):
         """
-        Получает варианты ответа для события.
+        Получает варианты ответа для события (из каталога в памяти).
         """
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                SELECT option_id, option_text 
-                FROM event_options 
-                WHERE event_id = ?
-                ORDER BY option_id
-            """, (event_id,))
-            options = await cursor.fetchall()
-            return [
-                {
-                    "option_id": option[0], 
-                    "option_text": option[1]
-                } 
-                for option in options
-            ]
+        catalog = await self._get_catalog()
+        return [dict(option) for option in catalog["options"].get(event_id, [])]
     
     async def get_free_response_option_id(self, event_id: int):
         """
         Получает ID варианта ответа для свободного голосования.
         """
-        await self.connect()
-        async with self.con.cursor() as cursor:
-            await cursor.execute("""
-                SELECT option_id FROM event_options 
-                WHERE event_id = ? AND option_text = '__FREE_RESPONSE__'
-            """, (event_id,))
-            result = await cursor.fetchone()
-            
-            # Отладочный вывод
-            print(f"DEBUG: Поиск __FREE_RESPONSE__ для event_id={event_id}")
-            print(f"DEBUG: Результат поиска: {result}")
-            
-        return result[0] if result else None
+        catalog = await self._get_catalog()
+        for option in catalog["options"].get(event_id, []):
+            if option["option_text"] == '__FREE_RESPONSE__':
+                return option["option_id"]
+        return None
     
     async def get_vote_results_with_text(self, event_id: int):
         """
         Получает результаты голосования, включая текстовые ответы.
         """
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             # Сначала получаем обычные результаты
             await cursor.execute("""
                 SELECT 
                     eo.option_text,
-                    COUNT(r.response_id) AS vote_count,
-                    GROUP_CONCAT(
-                        CASE 
-                            WHEN r.custom_text IS NOT NULL AND r.custom_text != '' 
-                            THEN r.user_name || ': ' || r.custom_text
-                            ELSE NULL
-                        END, 
-                        '\n'
+                    COALESCE(t.vote_count, 0) AS vote_count,
+                    (
+                        SELECT GROUP_CONCAT(r.user_name || ': ' || r.custom_text, '\n')
+                        FROM responses r
+                        WHERE r.option_id = eo.option_id
+                          AND r.custom_text IS NOT NULL AND r.custom_text != ''
                     ) AS text_responses
                 FROM event_options eo
-                LEFT JOIN responses r ON eo.option_id = r.option_id
+                LEFT JOIN vote_tallies t ON t.option_id = eo.option_id
                 WHERE eo.event_id = ?
-                GROUP BY eo.option_id
+                ORDER BY eo.option_id
             """, (event_id,))
             rows = await cursor.fetchall()
             
@@ -712,7 +1258,7 @@ class EventDatabase:
         Получает все текстовые ответы для открытого голосования.
         """
         await self.connect()
-        async with self.con.cursor() as cursor:
+        async with self._reader().cursor() as cursor:
             await cursor.execute("""
                 SELECT r.user_name, r.custom_text, r.response_time
                 FROM responses r
@@ -728,4 +1274,327 @@ class EventDatabase:
                     "response_time": row[2]
                 }
                 for row in rows
-            ]
\ No newline at end of file
+            ]
+
+    # Страница ответов открытого голосования, новые сверху. Пагинация по ключу
+    # (response_time, response_id), а не OFFSET: любая страница стоит как первая.
+    # older_than / newer_than — ключ последнего / первого ответа текущей страницы
+    async def get_open_vote_page(self, event_id: int, limit: int = 10, older_than=None, newer_than=None):
+        condition, params, order = "", [event_id], "DESC"
+        if older_than is not None:
+            condition = "AND (r.response_time, r.response_id) < (?, ?)"
+            params += list(older_than)
+        elif newer_than is not None:
+            # Идём к более новым в прямом порядке и разворачиваем результат
+            condition = "AND (r.response_time, r.response_id) > (?, ?)"
+            params += list(newer_than)
+            order = "ASC"
+        params.append(limit + 1)  # лишняя строка показывает, есть ли следующая страница
+
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute(f"""
+                SELECT r.response_id, r.user_name, r.custom_text, r.response_time
+                FROM responses r
+                JOIN event_options eo ON r.option_id = eo.option_id
+                WHERE r.event_id = ? AND eo.option_text = '__FREE_RESPONSE__' {condition}
+                ORDER BY r.response_time {order}, r.response_id {order}
+                LIMIT ?
+            """, params)
+            rows = await cursor.fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if order == "ASC":
+            rows.reverse()
+        return {
+            "responses": [
+                {
+                    "response_id": row[0],
+                    "user_name": row[1],
+                    "custom_text": row[2],
+                    "response_time": row[3],
+                }
+                for row in rows
+            ],
+            # Назад к новым можно, если пришли со следующей страницы или нашлась лишняя более новая строка
+            "has_newer": more if order == "ASC" else older_than is not None,
+            "has_older": more if order == "DESC" else True,
+        }
+
+    # Потоковое чтение для выгрузки в файл: строки отдаются пачками по chunk_size,
+    # весь результат в память не загружается
+    async def iter_open_vote_responses(self, event_id: int, chunk_size: int = 500):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("""
+                SELECT r.user_name, r.custom_text, r.response_time
+                FROM responses r
+                JOIN event_options eo ON r.option_id = eo.option_id
+                WHERE r.event_id = ? AND eo.option_text = '__FREE_RESPONSE__'
+                ORDER BY r.response_time, r.response_id
+            """, (event_id,))
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    # Список записавшихся пачками: by="classes" — по мастер-классам, by="groups" — по отрядам
+    async def iter_workshop_roster(self, event_id: int, by: str = "classes", chunk_size: int = 500):
+        order = {
+            "classes": "w.workshop_name, CAST(wr.group_number AS INTEGER), wr.user_name",
+            "groups": "CAST(wr.group_number AS INTEGER), wr.group_number, wr.user_name",
+        }[by]
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute(f"""
+                SELECT w.workshop_name, w.instructor, wr.user_name, wr.group_number, wr.registration_time
+                FROM workshop_registrations wr
+                JOIN workshops w ON wr.workshop_id = w.workshop_id
+                WHERE w.event_id = ?
+                ORDER BY {order}
+            """, (event_id,))
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    # Ищет ответы открытого голосования по словам (префиксам) через FTS5.
+    # Возвращает (всего найдено, страница результатов по убыванию релевантности)
+    async def search_open_vote_responses(self, event_id: int, text: str, limit: int = 10, offset: int = 0):
+        query = fts_query(text)
+        if not query:
+            return 0, []
+        # CROSS JOIN фиксирует порядок: сначала совпадения из индекса, потом ответы по rowid.
+        # Иначе планировщик перебирает все ответы события и для каждого проверяет MATCH
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("""
+                SELECT COUNT(*)
+                FROM responses_fts
+                CROSS JOIN responses r ON r.response_id = responses_fts.rowid
+                WHERE responses_fts MATCH ? AND r.event_id = ?
+            """, (query, event_id))
+            total = (await cursor.fetchone())[0]
+            if not total:
+                return 0, []
+            await cursor.execute("""
+                SELECT r.response_id, r.user_name, r.response_time,
+                       snippet(responses_fts, 0, ?, ?, '…', 24)
+                FROM responses_fts
+                CROSS JOIN responses r ON r.response_id = responses_fts.rowid
+                WHERE responses_fts MATCH ? AND r.event_id = ?
+                ORDER BY rank, r.response_id
+                LIMIT ? OFFSET ?
+            """, (MATCH_START, MATCH_END, query, event_id, limit, offset))
+            rows = await cursor.fetchall()
+        return total, [
+            {
+                "response_id": row[0],
+                "user_name": row[1],
+                "response_time": row[2],
+                "snippet": row[3],
+            }
+            for row in rows
+        ]
+
+    # Отмечает пользователя в реестре (вызывается на каждый апдейт, без обращения к базе)
+    def touch_user(self, user_id: int, first_name: str = None, username: str = None):
+        now = time.monotonic()
+        touched = self._users_touched.get(user_id)
+        if touched is not None and now - touched < self.users_touch_interval:
+            return
+        self._users_touched[user_id] = now
+        self._users_touched.move_to_end(user_id)
+        while len(self._users_touched) > self.participation_cache_size:
+            self._users_touched.popitem(last=False)
+        self._pending_users[user_id] = (first_name, username)
+
+    async def _users_flusher(self):
+        while True:
+            await asyncio.sleep(self.users_flush_interval)
+            try:
+                await self.flush_users()
+            except Exception as e:
+                print(f"Error flushing users: {e}")
+
+    # Пишет накопленных пользователей одной транзакцией
+    async def flush_users(self):
+        if not self._pending_users or self.con is None:
+            return
+        pending, self._pending_users = self._pending_users, {}
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    # Написал боту — значит, снова доступен для рассылок
+                    await cursor.executemany("""
+                        INSERT INTO users (user_id, first_name, username)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            first_name = excluded.first_name,
+                            username = excluded.username,
+                            last_seen = CURRENT_TIMESTAMP,
+                            is_blocked = 0
+                    """, [(user_id, first_name, username) for user_id, (first_name, username) in pending.items()])
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                # Не теряем пользователей: вернутся в следующую пачку
+                for user_id, value in pending.items():
+                    self._pending_users.setdefault(user_id, value)
+                raise
+
+    # Сводка по событиям для админских списков одним запросом
+    async def get_events_overview(self, event_types=None):
+        """
+        Возвращает события (при event_types — только этих типов) с живыми цифрами:
+        responses и voters — ответы и уникальные пользователи (голосования),
+        workshops, seats_taken, seats_total — мастер-классы и места в них
+        """
+        await self.connect()
+        query = """
+            SELECT e.event_id, e.event_name, e.event_description, e.event_type,
+                   COALESCE(r.responses, 0), COALESCE(r.voters, 0),
+                   COALESCE(w.workshops, 0), COALESCE(w.seats_taken, 0), COALESCE(w.seats_total, 0)
+            FROM events e
+            LEFT JOIN (
+                SELECT event_id, COUNT(*) AS responses, COUNT(DISTINCT user_id) AS voters
+                FROM responses
+                GROUP BY event_id
+            ) r ON r.event_id = e.event_id
+            LEFT JOIN (
+                SELECT event_id, COUNT(*) AS workshops,
+                       SUM(current_participants) AS seats_taken, SUM(max_participants) AS seats_total
+                FROM workshops
+                GROUP BY event_id
+            ) w ON w.event_id = e.event_id
+        """
+        params = ()
+        if event_types:
+            query += f" WHERE e.event_type IN ({', '.join('?' for _ in event_types)})"
+            params = tuple(event_types)
+        query += " ORDER BY e.event_id"
+
+        async with self._reader().cursor() as cursor:
+            await cursor.execute(query, params)
+            return [
+                {
+                    "event_id": row[0],
+                    "event_name": row[1],
+                    "event_description": row[2],
+                    "event_type": row[3],
+                    "responses": row[4],
+                    "voters": row[5],
+                    "workshops": row[6],
+                    "seats_taken": row[7],
+                    "seats_total": row[8],
+                }
+                for row in await cursor.fetchall()
+            ]
+
+    # Ответы и уникальные пользователи одного события — по индексу (event_id, user_id)
+    async def get_response_stats(self, event_id: int):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM responses WHERE event_id = ?", (event_id,)
+            )
+            responses, voters = await cursor.fetchone()
+            return {"responses": responses, "voters": voters}
+
+    async def count_users(self):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("SELECT COUNT(*), COALESCE(SUM(is_blocked), 0) FROM users")
+            total, blocked = await cursor.fetchone()
+            return {"total": total, "blocked": blocked}
+
+    # Страница пользователей для рассылки: по возрастанию user_id, начиная после after_user_id
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("""
+                SELECT user_id FROM users
+                WHERE user_id > ? AND is_blocked = 0
+                ORDER BY user_id
+                LIMIT ?
+            """, (after_user_id, limit))
+            return [row[0] for row in await cursor.fetchall()]
+
+    # Создаёт рассылку; None — по этому событию уже идёт другая (двойное нажатие)
+    async def create_broadcast(self, event_id: int, text: str):
+        await self.connect()
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    await cursor.execute("""
+                        INSERT INTO broadcasts (event_id, text)
+                        SELECT ?, ?
+                        WHERE NOT EXISTS (SELECT 1 FROM broadcasts WHERE event_id = ? AND status = 'running')
+                    """, (event_id, text, event_id))
+                    broadcast_id = cursor.lastrowid if cursor.rowcount else None
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+        return broadcast_id
+
+    # Сохраняет прогресс рассылки и помечает заблокировавших бота пользователей
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, blocked: int,
+                                      failed: int, blocked_user_ids=(), status: str = "running"):
+        await self.connect()
+        async with self._write_lock:
+            try:
+                async with self.con.cursor() as cursor:
+                    await cursor.execute("BEGIN IMMEDIATE")
+                    await cursor.executemany(
+                        "UPDATE users SET is_blocked = 1 WHERE user_id = ?",
+                        [(user_id,) for user_id in blocked_user_ids],
+                    )
+                    await cursor.execute("""
+                        UPDATE broadcasts
+                        SET last_user_id = ?, sent = ?, blocked = ?, failed = ?, status = ?,
+                            finished_at = CASE WHEN ? = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+                        WHERE broadcast_id = ?
+                    """, (last_user_id, sent, blocked, failed, status, status, broadcast_id))
+                    await self.con.commit()
+            except Exception:
+                await self.con.rollback()
+                raise
+
+    async def get_broadcast(self, broadcast_id: int):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("""
+                SELECT broadcast_id, event_id, text, status, last_user_id, sent, blocked, failed
+                FROM broadcasts WHERE broadcast_id = ?
+            """, (broadcast_id,))
+            row = await cursor.fetchone()
+            return _broadcast_row(row) if row else None
+
+    # Незавершённые рассылки (продолжаются после перезапуска)
+    async def get_running_broadcasts(self):
+        await self.connect()
+        async with self._reader().cursor() as cursor:
+            await cursor.execute("""
+                SELECT broadcast_id, event_id, text, status, last_user_id, sent, blocked, failed
+                FROM broadcasts WHERE status = 'running' ORDER BY broadcast_id
+            """)
+            return [_broadcast_row(row) for row in await cursor.fetchall()]
+
+
+def _broadcast_row(row):
+    return {
+        "broadcast_id": row[0],
+        "event_id": row[1],
+        "text": row[2],
+        "status": row[3],
+        "last_user_id": row[4],
+        "sent": row[5],
+        "blocked": row[6],
+        "failed": row[7],
+    }
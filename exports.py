@@ -0,0 +1,115 @@
+'''
+Выгрузка отчётов одним файлом вместо десятков сообщений.
+Строки читаются из базы пачками (fetchmany) и сразу пишутся в CSV или XLSX,
+поэтому память на чтение не растёт с числом ответов. Сам документ собирается
+и сохраняется в отдельном потоке, чтобы большой отчёт не останавливал цикл событий.
+'''
+
+import asyncio
+import csv
+import io
+
+from aiogram import types
+
+FORMATS = ("xlsx", "csv")
+
+# Текст, который Excel принял бы за формулу
+_FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+OPEN_VOTE_COLUMNS = ["№", "Пользователь", "Ответ", "Время ответа"]
+ROSTER_COLUMNS = {
+    "classes": ["Мастер-класс", "Ведущий", "Участник", "Отряд", "Время записи"],
+    "groups": ["Отряд", "Участник", "Мастер-класс", "Ведущий", "Время записи"],
+}
+
+
+def _safe_text(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvWriter:
+    # utf-8-sig и ";" — чтобы Excel сразу открыл файл с кириллицей по колонкам
+    def __init__(self, columns, title=None):
+        self.buffer = io.BytesIO()
+        self.text = io.TextIOWrapper(self.buffer, encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.text, delimiter=";")
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows([_safe_text(value) for value in row] for row in rows)
+
+    def finish(self):
+        self.text.flush()
+        data = self.buffer.getvalue()
+        self.text.detach()
+        return data
+
+
+class XlsxWriter:
+    # write_only: openpyxl не держит ячейки в памяти, а сразу пишет их во временный XML
+    def __init__(self, columns, title="Отчёт"):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        self._cell = WriteOnlyCell
+        self._illegal = ILLEGAL_CHARACTERS_RE
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title[:31])
+        self.sheet.append(columns)
+
+    def _value(self, value):
+        if not isinstance(value, str):
+            return value
+        cell = self._cell(self.sheet, self._illegal.sub("", value))
+        cell.data_type = "s"  # ответ пользователя — всегда текст, не формула
+        return cell
+
+    def write(self, rows):
+        for row in rows:
+            self.sheet.append([self._value(value) for value in row])
+
+    def finish(self):
+        data = io.BytesIO()
+        self.workbook.save(data)
+        self.workbook.close()
+        return data.getvalue()
+
+
+WRITERS = {"xlsx": XlsxWriter, "csv": CsvWriter}
+
+
+async def _build(fmt, columns, title, chunks, prepare):
+    """Пишет пачки строк из chunks в документ; вся работа с документом — в потоке"""
+    loop = asyncio.get_running_loop()
+    writer = await loop.run_in_executor(None, WRITERS[fmt], columns, title)
+    count = 0
+    async for rows in chunks:
+        rows = prepare(rows, count)
+        await loop.run_in_executor(None, writer.write, rows)
+        count += len(rows)
+    return await loop.run_in_executor(None, writer.finish), count
+
+
+async def export_open_vote(db, event_id, fmt="xlsx"):
+    """Ответы открытого голосования одним документом"""
+    def numbered(rows, start):
+        return [(start + number, user_name, custom_text or "", response_time)
+                for number, (user_name, custom_text, response_time) in enumerate(rows, 1)]
+
+    data, count = await _build(fmt, OPEN_VOTE_COLUMNS, "Ответы", db.iter_open_vote_responses(event_id), numbered)
+    return types.InputFile(io.BytesIO(data), filename=f"open_vote_{event_id}.{fmt}"), count
+
+
+async def export_workshop_roster(db, event_id, by="classes", fmt="xlsx"):
+    """Записи на мастер-классы одним документом, по мастер-классам или по отрядам"""
+    def ordered(rows, start):
+        if by == "groups":
+            return [(group, user, workshop, instructor, time)
+                    for workshop, instructor, user, group, time in rows]
+        return rows
+
+    data, count = await _build(fmt, ROSTER_COLUMNS[by], "Записи", db.iter_workshop_roster(event_id, by), ordered)
+    return types.InputFile(io.BytesIO(data), filename=f"workshops_{by}_{event_id}.{fmt}"), count
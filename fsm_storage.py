@@ -0,0 +1,205 @@
+'''
+Хранилище состояний FSM в SQLite вместо MemoryStorage:
+состояния переживают перезапуск, а память не растёт с числом пользователей
+'''
+
+import asyncio
+import copy
+import json
+import time
+import typing
+from collections import OrderedDict
+
+import aiosqlite
+from aiogram.dispatcher.storage import BaseStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Состояния лежат в отдельном файле SQLite.
+    Перед базой стоит ограниченный LRU-кэш; изменения копятся в памяти и
+    пишутся одной транзакцией раз в flush_interval секунд (несколько правок
+    одного пользователя за это время превращаются в одну запись).
+    Состояния, не менявшиеся дольше ttl секунд, считаются брошенными и удаляются.
+    """
+
+    def __init__(self, db_name="fsm.db", cache_size=10000, ttl=24 * 3600, flush_interval=1.0):
+        self.db_name = db_name
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.con = None
+        self._cache = OrderedDict()
+        # Изменённые, но ещё не записанные состояния, и пачка, которая пишется прямо сейчас
+        self._dirty = {}
+        self._flushing = {}
+        self._flush_task = None
+        self._stop_flusher = None
+        self._connect_lock = asyncio.Lock()
+        self._last_cleanup = 0.0
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.con is None:
+                self.con = await aiosqlite.connect(self.db_name)
+                await self.con.execute("PRAGMA journal_mode=WAL")
+                await self.con.execute("PRAGMA synchronous=NORMAL")
+                await self.con.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_states (
+                        chat TEXT NOT NULL,
+                        user TEXT NOT NULL,
+                        state TEXT,
+                        data TEXT NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (chat, user)
+                    ) WITHOUT ROWID
+                """)
+                await self.con.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+                await self.con.commit()
+                await self._delete_expired()
+                self._stop_flusher = asyncio.Event()
+                self._flush_task = asyncio.create_task(self._flusher())
+
+    async def close(self):
+        # Флашер не отменяем, а просим остановиться и ждём: отмена посреди записи
+        # потеряла бы пачку и столкнула бы его BEGIN с финальным flush() ниже
+        if self._flush_task is not None:
+            self._stop_flusher.set()
+            await self._flush_task
+            self._flush_task = None
+        if self.con is not None:
+            await self.flush()
+            await self.con.close()
+            self.con = None
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    async def _get_entry(self, key):
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+        else:
+            entry = self._dirty.get(key) or self._flushing.get(key)
+            if entry is None:
+                entry = await self._load(key)
+            # Пока грузили, запись могла появиться от другого апдейта этого же пользователя
+            entry = self._cache.setdefault(key, entry)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        if entry["updated_at"] < time.time() - self.ttl:
+            entry["state"] = None
+            entry["data"] = {}
+        return entry
+
+    async def _load(self, key):
+        await self.connect()
+        async with self.con.execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE chat = ? AND user = ?", key
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return {"state": None, "data": {}, "updated_at": time.time()}
+        return {"state": row[0], "data": json.loads(row[1]), "updated_at": row[2]}
+
+    def _touch(self, key, entry):
+        entry["updated_at"] = time.time()
+        self._dirty[key] = entry
+
+    async def _flusher(self):
+        while not self._stop_flusher.is_set():
+            try:
+                await asyncio.wait_for(self._stop_flusher.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if time.time() - self._last_cleanup > min(self.ttl, 3600):
+                    await self._delete_expired()
+            except Exception as e:
+                print(f"Error in FSM storage flush: {e}")
+
+    async def flush(self):
+        if not self._dirty or self.con is None:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        try:
+            rows_to_save = []
+            keys_to_delete = []
+            for key, entry in self._flushing.items():
+                if entry["state"] is None and not entry["data"]:
+                    keys_to_delete.append(key)
+                else:
+                    rows_to_save.append((*key, entry["state"], json.dumps(entry["data"], ensure_ascii=False), entry["updated_at"]))
+            await self.con.execute("BEGIN")
+            await self.con.executemany("""
+                INSERT INTO fsm_states (chat, user, state, data, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(chat, user) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """, rows_to_save)
+            await self.con.executemany("DELETE FROM fsm_states WHERE chat = ? AND user = ?", keys_to_delete)
+            await self.con.commit()
+        except Exception:
+            await self.con.rollback()
+            # Не потерять изменения: вернём их в очередь, если их не успели перезаписать
+            for key, entry in self._flushing.items():
+                self._dirty.setdefault(key, entry)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _delete_expired(self):
+        self._last_cleanup = time.time()
+        await self.con.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+        await self.con.commit()
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        entry = await self._get_entry(self._key(chat, user))
+        return entry["state"] if entry["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[str] = None) -> typing.Dict:
+        entry = await self._get_entry(self._key(chat, user))
+        return copy.deepcopy(entry["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key = self._key(chat, user)
+        entry = await self._get_entry(key)
+        entry["state"] = self.resolve_state(state)
+        self._touch(key, entry)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key = self._key(chat, user)
+        entry = await self._get_entry(key)
+        entry["data"] = copy.deepcopy(data) if data else {}
+        self._touch(key, entry)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        if data is None:
+            data = {}
+        key = self._key(chat, user)
+        entry = await self._get_entry(key)
+        entry["data"].update(copy.deepcopy(data), **kwargs)
+        self._touch(key, entry)
@@ -0,0 +1,52 @@
+'''
+Замер времени импортов при старте бота (аналог python -X importtime):
+для каждого модуля считается собственное и накопленное время загрузки
+'''
+
+import builtins
+import logging
+import sys
+import time
+
+_original_import = builtins.__import__
+_stack = []
+# (модуль, собственное время, накопленное время) в секундах
+timings = []
+started_at = None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Относительные и уже загруженные модули не замеряем
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - started
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        timings.append((name, elapsed - children, elapsed))
+
+
+def install():
+    global started_at
+    started_at = time.perf_counter()
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    builtins.__import__ = _original_import
+
+
+def report(limit=15):
+    if started_at is None:
+        return
+    total = sum(self_time for _, self_time, _ in timings)
+    logging.info("Импорт модулей при старте: %.0f ms, модулей: %d", total * 1000, len(timings))
+    logging.info("%10s | %10s | %s", "self [ms]", "cumul [ms]", "module")
+    for name, self_time, cumulative in sorted(timings, key=lambda t: t[2], reverse=True)[:limit]:
+        logging.info("%10.1f | %10.1f | %s", self_time * 1000, cumulative * 1000, name)
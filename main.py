@@ -1,3 +1,6 @@
+import import_timer
+import_timer.install()
+
 import logging
 from admin_handlers import *
 from user_handlers import *
@@ -6,10 +9,22 @@ from aiogram import Dispatcher, types
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from aiogram.utils import executor
 from aiogram.dispatcher import FSMContext
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from event import *
-from bot_instance import bot
+from bot_instance import bot, send_scheduler
+from db_instance import db
+from charts import renderer
+from broadcast import broadcaster
+from backup import backups
+from middlewares import UsersMiddleware
+from metrics import HandlerMetricsMiddleware, QueryMetrics, MetricsServer, register_runtime_gauges
+from query_trace import QueryTracer, QueryTraceMiddleware
+from fsm_storage import SQLiteStorage
+from config import FSM_DB_NAME, FSM_CACHE_SIZE, FSM_TTL_HOURS, FSM_FLUSH_INTERVAL, BOT_MODE
+from config import METRICS_HOST, METRICS_PORT, CLUSTER_WORKER_INDEX
+from config import QUERY_TRACE_MAX_QUERIES, QUERY_TRACE_MAX_ROWS, QUERY_TRACE_MAX_REPEATS, QUERY_TRACE_STRICT
+
+import_timer.uninstall()
 
 # class EventState(StatesGroup):
 #     waiting_for_event_type = State()
@@ -29,14 +44,58 @@ from bot_instance import bot
 logging.basicConfig(level=logging.INFO)
 
 # Создание диспетчера
-storage = MemoryStorage()
+# Состояния FSM хранятся в SQLite и переживают перезапуск бота
+storage = SQLiteStorage(
+    FSM_DB_NAME,
+    cache_size=FSM_CACHE_SIZE,
+    ttl=FSM_TTL_HOURS * 3600,
+    flush_interval=FSM_FLUSH_INTERVAL,
+)
 dp = Dispatcher(bot, storage=storage)  # Передаём bot из bot_instance.py
-db = EventDatabase()
+dp.middleware.setup(UsersMiddleware(db))
+dp.middleware.setup(HandlerMetricsMiddleware())
+
+# Метрики: время хендлеров и SQL-запросов, очереди отправки и записи
+db.add_query_hook(QueryMetrics())
+register_runtime_gauges(db, send_scheduler)
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+
+# Запросы к базе на каждый апдейт: предупреждение о N+1 и слишком тяжёлых хендлерах.
+# Отчёты админа читают все записи события, для них порог по строкам снят
+query_tracer = QueryTracer(
+    max_queries=QUERY_TRACE_MAX_QUERIES,
+    max_rows=QUERY_TRACE_MAX_ROWS,
+    max_repeats=QUERY_TRACE_MAX_REPEATS,
+    strict=QUERY_TRACE_STRICT,
+    budgets={
+        "visualize_by_classes": {"max_rows": None},
+        "visualize_by_groups": {"max_rows": None},
+        "export_report": {"max_rows": None},
+    },
+)
+db.add_query_hook(query_tracer)
+dp.middleware.setup(QueryTraceMiddleware(query_tracer))
 
 async def on_start(dp):
+    import_timer.report()
+    renderer.start()
     await db.connect()  # Подключаемся к базе данных
+    await storage.connect()
+    # В режиме cluster.py фоновые задачи на всю базу ведёт только воркер 0
+    if CLUSTER_WORKER_INDEX == 0:
+        await broadcaster.resume()
+        backups.start()
+    await metrics_server.start()
     print("Бот запущен и подключен к базе данных!")
 
+async def on_shutdown(dp):
+    renderer.shutdown()
+    await broadcaster.stop()
+    await backups.stop()
+    await metrics_server.stop()
+    await send_scheduler.close()
+    await db.close()
+
 # Регистрация обработчиков
 dp.register_message_handler(add_event, commands=['add_event'], state='*')
 dp.register_callback_query_handler(process_event_type, lambda c: c.data in ["vote", "workshop", "open_vote"], state=EventState.waiting_for_event_type)
@@ -53,10 +112,15 @@ dp.register_callback_query_handler(admin_delete_event, lambda c: c.data.startswi
 dp.register_callback_query_handler(admin_back_to_events, lambda c: c.data == "admin_back_to_events")
 dp.register_message_handler(visualize_vote, commands=['visualize_votes'])
 dp.register_callback_query_handler(visualize_vote_results, lambda c: c.data.startswith("visualize_vote_"))
+dp.register_message_handler(rebuild_tallies, commands=['rebuild_tallies'])
+dp.register_message_handler(send_stats, commands=['send_stats'])
+dp.register_message_handler(broadcast_menu, commands=['broadcast'])
+dp.register_callback_query_handler(start_broadcast, lambda c: c.data.startswith("broadcast_event_"))
 dp.register_message_handler(select_workshop_event, commands=['visualize_workshop'])
 dp.register_callback_query_handler(select_visualization_method, lambda c: c.data.startswith("visualize_workshop_event_"))
 dp.register_callback_query_handler(visualize_by_classes, lambda c: c.data.startswith("visualize_by_classes_"))
 dp.register_callback_query_handler(visualize_by_groups, lambda c: c.data.startswith("visualize_by_groups_"))
+dp.register_callback_query_handler(export_report, lambda c: c.data.startswith("export_"))
 dp.register_message_handler(reset_state, commands=["reset"], state="*")
 dp.register_message_handler(select_event, commands=["start"])
 dp.register_callback_query_handler(process_event_selection, lambda c: c.data.startswith("event_"))
@@ -69,8 +133,17 @@ dp.register_message_handler(process_group_number, state=EventState.waiting_for_g
 dp.register_message_handler(process_vote_options, state=EventState.waiting_for_vote_options)
 dp.register_message_handler(process_open_vote_response, state=OpenVoteState.waiting_for_text_response)
 dp.register_callback_query_handler(process_open_vote_selection, lambda c: c.data.startswith("visualize_open_vote_"))
+dp.register_callback_query_handler(open_vote_page_navigation, lambda c: c.data.startswith("ovp_"))
 dp.register_message_handler(select_open_vote_event, commands=['visualize_open_vote'])
+dp.register_message_handler(search_answers, commands=['search_answers'])
+dp.register_callback_query_handler(choose_search_event, lambda c: c.data.startswith("search_open_vote_"))
+dp.register_message_handler(process_search_query, state=SearchState.waiting_for_query)
+dp.register_callback_query_handler(search_page, lambda c: c.data.startswith("search_page_"), state="*")
 dp.register_message_handler(cmd_send_all_db, commands=["киньБдПлиз"])
 
 if __name__ == "__main__":
-    executor.start_polling(dp, on_startup=on_start)
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        from webhook import start_webhook
+        start_webhook(dp, on_startup=on_start, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_start, on_shutdown=on_shutdown)
\ No newline at end of file
@@ -0,0 +1,216 @@
+'''
+Метрики в формате Prometheus: время и ошибки хендлеров, время SQL-запросов,
+очереди отправки и записи. Отдаются текстом на /metrics локального HTTP-порта.
+'''
+
+import bisect
+import contextvars
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from db_trace import statement_kind
+
+# Границы бакетов гистограмм, секунды
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=HANDLER_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счётчики по бакетам..., +Inf], сумма
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", _labels(self.labelnames, key, [("le", le)]), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), cumulative
+
+
+class Gauge:
+    """
+    Значение считывается функцией в момент запроса /metrics.
+    kind="counter" — для счётчиков, которые уже ведёт сам объект (send_queue, кэш базы)
+    """
+
+    def __init__(self, name, documentation, function, labelname=None, kind="gauge"):
+        self.type = kind
+        self.name = name
+        self.documentation = documentation
+        self.function = function  # число или словарь {значение метки: число}, если задан labelname
+        self.labelname = labelname
+
+    def samples(self):
+        value = self.function()
+        if self.labelname is None:
+            yield self.name, "", value
+        else:
+            for label, item in sorted(value.items()):
+                yield self.name, _labels((self.labelname,), (label,)), item
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера", ["handler"], HANDLER_BUCKETS))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Необработанные исключения в хендлере", ["handler"]))
+query_duration = registry.register(Histogram(
+    "bot_db_query_duration_seconds", "Время SQL-запроса по методу базы", ["query", "statement"], QUERY_BUCKETS))
+rows_fetched = registry.register(Counter(
+    "bot_db_rows_fetched_total", "Строк прочитано из базы", ["query"]))
+
+_current_handler_name = contextvars.ContextVar("metrics_handler_name", default=None)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет каждый хендлер: время от прохождения фильтров до конца обработки
+    и число исключений, дошедших до диспетчера
+    """
+
+    async def _start(self, obj, data):
+        name = current_handler.get().__name__
+        _current_handler_name.set(name)
+        data["_metrics_handler"] = (name, time.perf_counter())
+
+    async def _finish(self, obj, results, data):
+        started = data.pop("_metrics_handler", None)
+        if started is not None:
+            handler_duration.observe(time.perf_counter() - started[1], handler=started[0])
+
+    on_process_message = _start
+    on_process_edited_message = _start
+    on_process_callback_query = _start
+    on_post_process_message = _finish
+    on_post_process_edited_message = _finish
+    on_post_process_callback_query = _finish
+
+    async def on_pre_process_error(self, update, error, data):
+        handler_errors.inc(handler=_current_handler_name.get() or "unknown")
+
+
+class QueryMetrics:
+    """Хук EventDatabase: время каждого запроса и число прочитанных строк"""
+
+    def on_execute(self, name, sql, seconds, many):
+        query_duration.observe(seconds, query=name, statement=statement_kind(sql))
+
+    def on_fetch(self, name, rows):
+        rows_fetched.inc(rows, query=name)
+
+
+def register_runtime_gauges(db, send_scheduler):
+    def send_queue_depth():
+        stats = send_scheduler.get_stats()
+        return {"user": stats["queued_user"], "report": stats["queued_report"], "broadcast": stats["queued_broadcast"]}
+
+    registry.register(Gauge(
+        "bot_send_queue_depth", "Сообщений в очереди отправки по приоритету", send_queue_depth, labelname="priority"))
+    registry.register(Gauge("bot_send_in_flight", "Отправок в процессе", lambda: send_scheduler.in_flight))
+    registry.register(Gauge(
+        "bot_send_sent_total", "Отправлено сообщений", lambda: send_scheduler.sent, kind="counter"))
+    registry.register(Gauge(
+        "bot_send_retry_after_total", "Ответов RetryAfter от Telegram", lambda: send_scheduler.retry_after,
+        kind="counter"))
+    registry.register(Gauge(
+        "bot_db_response_queue_depth", "Голосов ждут группового коммита", lambda: db.get_write_stats()["queue_depth"]))
+    registry.register(Gauge(
+        "bot_db_duplicate_responses_total", "Повторных ответов, отсечённых базой",
+        lambda: db.write_stats["duplicates"], kind="counter"))
+    registry.register(Gauge(
+        "bot_db_catalog_hits_total", "Попаданий в кэш каталога", lambda: db.cache_hits, kind="counter"))
+    registry.register(Gauge(
+        "bot_db_catalog_misses_total", "Промахов кэша каталога", lambda: db.cache_misses, kind="counter"))
+
+
+class MetricsServer:
+    def __init__(self, host="127.0.0.1", port=9100):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def start(self):
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
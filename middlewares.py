@@ -0,0 +1,25 @@
+'''
+Мидлвари диспетчера
+'''
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+class UsersMiddleware(BaseMiddleware):
+    """
+    Заносит в реестр пользователей автора каждого апдейта.
+    Запись в базу идёт пачками в фоне, обработку апдейта это не задерживает
+    """
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        # my_chat_member приходит и когда пользователь блокирует бота — это не активность
+        source = update.message or update.callback_query or update.edited_message or update.inline_query
+        if source is None or source.from_user is None or source.from_user.is_bot:
+            return
+        user = source.from_user
+        self.db.touch_user(user.id, user.first_name, user.username)
@@ -0,0 +1,137 @@
+'''
+Счётчик запросов к базе на каждый апдейт.
+Предупреждает, когда хендлер делает слишком много запросов, читает слишком
+много строк или повторяет один и тот же запрос в цикле (N+1).
+В строгом режиме такое превышение — исключение, чтобы регрессия ловилась прогоном.
+'''
+
+import contextvars
+import logging
+from collections import Counter
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+class QueryBudgetExceeded(Exception):
+    """Хендлер вышел за бюджет запросов (только в строгом режиме)"""
+
+
+class UpdateTrace:
+    __slots__ = ("update_id", "handler", "queries", "rows", "statements")
+
+    def __init__(self, update_id):
+        self.update_id = update_id
+        self.handler = None
+        self.queries = 0
+        self.rows = 0
+        self.statements = Counter()
+
+
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+
+
+class QueryTracer:
+    """
+    Хук EventDatabase (см. add_query_hook) и учёт по хендлерам.
+    budgets: {имя хендлера: {"max_queries": ..., "max_rows": ..., "max_repeats": ...}}
+    переопределяет общие пороги; None в значении — без ограничения
+    """
+
+    def __init__(self, max_queries=15, max_rows=500, max_repeats=4, strict=False, budgets=None):
+        self.max_queries = max_queries
+        self.max_rows = max_rows
+        self.max_repeats = max_repeats
+        self.strict = strict
+        self.budgets = budgets or {}
+        self.stats = {}  # хендлер -> сводка
+        self.violations = 0
+
+    # Хук базы: вызывается в задаче того апдейта, который делает запрос
+    def on_execute(self, name, sql, seconds, many):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.queries += 1
+            trace.statements[" ".join(sql.split())] += 1
+
+    def on_fetch(self, name, rows):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.rows += rows
+
+    def _limit(self, handler, key):
+        budget = self.budgets.get(handler, {})
+        return budget[key] if key in budget else getattr(self, key)
+
+    def check(self, trace):
+        """Возвращает список нарушений для завершённого апдейта"""
+        problems = []
+        handler = trace.handler
+        max_queries = self._limit(handler, "max_queries")
+        max_rows = self._limit(handler, "max_rows")
+        max_repeats = self._limit(handler, "max_repeats")
+
+        if max_queries is not None and trace.queries > max_queries:
+            problems.append(f"{trace.queries} запросов (порог {max_queries})")
+        if max_rows is not None and trace.rows > max_rows:
+            problems.append(f"{trace.rows} строк (порог {max_rows})")
+        if max_repeats is not None:
+            for sql, count in trace.statements.most_common():
+                if count <= max_repeats:
+                    break
+                problems.append(f"запрос повторён {count} раз, похоже на N+1: {sql[:120]}")
+        return problems
+
+    def finish(self, trace):
+        if trace.handler is None:
+            return
+        stats = self.stats.setdefault(trace.handler, {
+            "updates": 0, "queries": 0, "rows": 0, "max_queries": 0, "max_rows": 0, "violations": 0,
+        })
+        stats["updates"] += 1
+        stats["queries"] += trace.queries
+        stats["rows"] += trace.rows
+        stats["max_queries"] = max(stats["max_queries"], trace.queries)
+        stats["max_rows"] = max(stats["max_rows"], trace.rows)
+
+        problems = self.check(trace)
+        if not problems:
+            return
+        stats["violations"] += 1
+        self.violations += 1
+        message = f"Хендлер {trace.handler} (апдейт {trace.update_id}): " + "; ".join(problems)
+        logging.warning("Бюджет запросов: %s", message)
+        if self.strict:
+            raise QueryBudgetExceeded(message)
+
+    def get_stats(self):
+        return {
+            handler: dict(stats, avg_queries=round(stats["queries"] / stats["updates"], 2))
+            for handler, stats in sorted(self.stats.items())
+        }
+
+
+class QueryTraceMiddleware(BaseMiddleware):
+    def __init__(self, tracer):
+        super().__init__()
+        self.tracer = tracer
+
+    async def on_pre_process_update(self, update, data):
+        data["_query_trace_token"] = _current_trace.set(UpdateTrace(update.update_id))
+
+    async def _remember_handler(self, obj, data):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.handler = current_handler.get().__name__
+
+    on_process_message = _remember_handler
+    on_process_edited_message = _remember_handler
+    on_process_callback_query = _remember_handler
+
+    async def on_post_process_update(self, update, results, data):
+        trace = _current_trace.get()
+        token = data.pop("_query_trace_token", None)
+        if token is not None:
+            _current_trace.reset(token)
+        if trace is not None:
+            self.tracer.finish(trace)
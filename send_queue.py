@@ -0,0 +1,302 @@
+'''
+Единая очередь исходящих сообщений.
+Все отправки бота проходят через планировщик с лимитами Telegram:
+общий (~30 сообщений в секунду) и на каждый чат (1 в секунду, в группу 20 в минуту).
+RetryAfter обрабатывается здесь же, хендлеры его не видят.
+'''
+
+import asyncio
+import contextvars
+import heapq
+import io
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import RetryAfter
+
+
+# Приоритеты: меньше — раньше. Ответы пользователям идут впереди админских отчётов,
+# массовые рассылки — в самом конце
+PRIORITY_USER = 0
+PRIORITY_REPORT = 1
+PRIORITY_BROADCAST = 2
+
+# Методы, которые Telegram ограничивает по частоте в чате
+QUEUED_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup", "sendAudio",
+    "sendVideo", "sendAnimation", "sendVoice", "sendSticker", "sendLocation",
+    "sendContact", "sendPoll", "forwardMessage", "copyMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+}
+
+_priority = contextvars.ContextVar("send_priority", default=PRIORITY_USER)
+
+
+@contextmanager
+def priority(level):
+    """
+    Отправки внутри блока получают заданный приоритет:
+
+        with send_queue.priority(PRIORITY_REPORT):
+            await message.answer(...)
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _is_group(chat_id):
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return True  # @username канала
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # токенов в секунду
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до следующего токена"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class SendScheduler:
+    """
+    Очередь отправок с приоритетами. Сообщения одного чата уходят строго по порядку
+    и по одному за раз; разные чаты отправляются параллельно в пределах общего лимита.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1.0, chat_burst=3, group_rate_per_min=20,
+                 max_retries=5, max_buckets=10000):
+        self.global_bucket = TokenBucket(global_rate, 1)  # без всплесков: Telegram считает лимит по скользящему окну
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+
+        self._chats = {}  # chat_id -> deque заданий
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._active = set()  # чаты, стоящие в _ready, ждущие таймера или с отправкой в процессе
+        self._ready = []  # куча (priority, seq, chat_id)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+        self._paused_until = 0.0
+        self._tasks = set()
+
+        self.sent = 0
+        self.errors = 0
+        self.retry_after = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self._queued = 0
+
+    def _get_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune_buckets()
+            # Отрицательный chat_id — группа или канал, там лимит строже
+            if _is_group(chat_id):
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        # Полное ведро ничем не отличается от нового, его можно забыть
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._active and b.is_full()]:
+            del self._buckets[chat_id]
+
+    def _push(self, chat_id):
+        jobs = self._chats.get(chat_id)
+        if not jobs:
+            self._active.discard(chat_id)
+            self._chats.pop(chat_id, None)
+            return
+        job_priority, seq = jobs[0][0], jobs[0][1]
+        heapq.heappush(self._ready, (job_priority, seq, chat_id))
+        self._wakeup.set()
+
+    def start(self):
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, chat_id, send, level=None):
+        """
+        Ставит отправку в очередь и ждёт её результата.
+        send — функция без аргументов, возвращающая корутину запроса к API
+        """
+        self.start()
+        level = _priority.get() if level is None else level
+        future = asyncio.get_running_loop().create_future()
+        self._chats.setdefault(chat_id, deque()).append((level, next(self._seq), send, future, 0))
+        self._queued += 1
+        if self._queued > self.max_depth:
+            self.max_depth = self._queued
+        if chat_id not in self._active:
+            self._active.add(chat_id)
+            self._push(chat_id)
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # Общий лимит и пауза после RetryAfter действуют на все чаты.
+            # Ждём до выбора чата, чтобы за время ожидания вперёд успели встать срочные ответы
+            wait = max(self.global_bucket.delay(), self._paused_until - time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            bucket = self._get_bucket(chat_id)
+            wait = bucket.delay()
+            if wait > 0:
+                loop.call_later(wait, self._push, chat_id)
+                continue
+            self.global_bucket.consume()
+            bucket.consume()
+
+            job = self._chats[chat_id].popleft()
+            self._queued -= 1
+            self.in_flight += 1
+            task = asyncio.create_task(self._send(chat_id, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, chat_id, job):
+        level, seq, send, future, attempt = job
+        try:
+            result = await send()
+        except RetryAfter as e:
+            self.retry_after += 1
+            if attempt >= self.max_retries:
+                self.errors += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                print(f"Telegram просит подождать {e.timeout} с, чат {chat_id}")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+                # Возвращаем задание в голову очереди чата, порядок сообщений не меняется
+                self._chats.setdefault(chat_id, deque()).appendleft((level, seq, send, future, attempt + 1))
+                self._queued += 1
+        except Exception as e:
+            self.errors += 1
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            self._push(chat_id)
+
+    def depth(self):
+        return self._queued
+
+    def get_stats(self):
+        by_priority = {}
+        for jobs in self._chats.values():
+            for job in jobs:
+                by_priority[job[0]] = by_priority.get(job[0], 0) + 1
+        return {
+            "queued": sum(by_priority.values()),
+            "queued_user": by_priority.get(PRIORITY_USER, 0),
+            "queued_report": by_priority.get(PRIORITY_REPORT, 0),
+            "queued_broadcast": by_priority.get(PRIORITY_BROADCAST, 0),
+            "chats_waiting": len(self._active),
+            "in_flight": self.in_flight,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "errors": self.errors,
+            "retry_after": self.retry_after,
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 1)),
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+
+def _file_factory(value):
+    """
+    Для файла из запроса возвращает функцию, дающую свежий поток на каждую попытку.
+    aiohttp дочитывает и закрывает поток при загрузке, поэтому повтор после
+    RetryAfter с тем же потоком отправил бы пустой файл
+    """
+    if isinstance(value, types.InputFile):
+        filename, stream = value.filename, value.file
+    elif isinstance(value, tuple):
+        filename, stream = value
+    else:
+        filename, stream = getattr(value, "name", None), value
+
+    if isinstance(stream, io.BytesIO):
+        data = stream.getvalue()
+        return lambda: (filename, io.BytesIO(data))
+    path = getattr(stream, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return lambda: (filename, open(path, "rb"))
+    return lambda: value  # поток, который нельзя перечитать, уходит как есть
+
+
+class QueuedBot(Bot):
+    """
+    Bot, у которого все отправки в чаты идут через SendScheduler.
+    Остальные методы (getFile, answerCallbackQuery и т.п.) вызываются напрямую
+    """
+
+    def __init__(self, *args, scheduler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or SendScheduler()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method in QUEUED_METHODS and data and "chat_id" in data:
+            factories = {key: _file_factory(value) for key, value in (files or {}).items()}
+
+            def send():
+                attempt_files = {key: factory() for key, factory in factories.items()} or files
+                return super(QueuedBot, self).request(method, data, attempt_files, **kwargs)
+
+            return await self.scheduler.submit(data["chat_id"], send)
+        return await super().request(method, data, files, **kwargs)
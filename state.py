@@ -21,3 +21,6 @@ class EventState(StatesGroup):
 
 class OpenVoteState(StatesGroup):
     waiting_for_text_response = State()
+
+class SearchState(StatesGroup):
+    waiting_for_query = State()
@@ -0,0 +1,34 @@
+'''
+Старт бота не тянет тяжёлые библиотеки: pandas и matplotlib импортируются
+только там, где нужны (разбор Excel, графики)
+'''
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import sys
+import main
+heavy = sorted(name for name in ("pandas", "matplotlib") if name in sys.modules)
+print("heavy:" + ",".join(heavy))
+"""
+
+
+def test_main_does_not_import_heavy_modules(tmp_path):
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA",
+        DB_NAME=str(tmp_path / "events.db"),
+        FSM_DB_NAME=str(tmp_path / "fsm.db"),
+        METRICS_PORT="0",
+        PYTHONPATH=ROOT,
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    heavy = [line for line in result.stdout.splitlines() if line.startswith("heavy:")]
+    assert heavy == ["heavy:"], f"загружены при старте: {heavy}"
@@ -0,0 +1,89 @@
+'''
+Строгий режим QueryTracer: настоящий хендлер, вышедший за бюджет, роняет обработку апдейта
+'''
+
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+
+from aiogram import Bot, Dispatcher, types
+
+import admin_handlers
+from config import YOUR_ADMIN_ID
+from event import EventDatabase
+from query_trace import QueryTracer, QueryTraceMiddleware, QueryBudgetExceeded
+
+OPEN_VOTES = 3
+
+
+class RecordingBot(Bot):
+    """Бот без сети: запоминает вызовы API"""
+
+    def __init__(self):
+        super().__init__("123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+        self.sent = []
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.sent.append((method, data))
+        return {"message_id": len(self.sent), "date": 0, "chat": {"id": YOUR_ADMIN_ID, "type": "private"}}
+
+
+def _command_update(text):
+    return types.Update(**{
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": YOUR_ADMIN_ID, "type": "private"},
+            "from": {"id": YOUR_ADMIN_ID, "is_bot": False, "first_name": "Админ"},
+            "text": text,
+        },
+    })
+
+
+async def _run_handler(db_name, tracer):
+    db = EventDatabase(db_name)
+    await db.connect()
+    for number in range(OPEN_VOTES):
+        await db.add_event(f"Опрос {number}", "Описание", "open_vote")
+    db.add_query_hook(tracer)
+
+    bot = RecordingBot()
+    dp = Dispatcher(bot)
+    dp.middleware.setup(QueryTraceMiddleware(tracer))
+    dp.register_message_handler(admin_handlers.select_open_vote_event, commands=["visualize_open_vote"])
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    saved_db, admin_handlers.db = admin_handlers.db, db
+    try:
+        # process_updates, как при polling: process_update не вызывает middleware апдейта
+        await dp.process_updates([_command_update("/visualize_open_vote")])
+    finally:
+        admin_handlers.db = saved_db
+        await db.close()
+    return bot
+
+
+def test_strict_budget_raises_for_real_handler(tmp_path):
+    tracer = QueryTracer(strict=True, budgets={"select_open_vote_event": {"max_rows": OPEN_VOTES - 1}})
+
+    with pytest.raises(QueryBudgetExceeded, match="select_open_vote_event"):
+        asyncio.run(_run_handler(str(tmp_path / "events.db"), tracer))
+
+    assert tracer.violations == 1
+    stats = tracer.get_stats()["select_open_vote_event"]
+    assert stats["max_rows"] == OPEN_VOTES
+    assert stats["violations"] == 1
+
+
+def test_handler_within_budget(tmp_path):
+    tracer = QueryTracer(strict=True, budgets={"select_open_vote_event": {"max_rows": OPEN_VOTES}})
+
+    bot = asyncio.run(_run_handler(str(tmp_path / "events.db"), tracer))
+
+    assert tracer.violations == 0
+    assert [method for method, _ in bot.sent] == ["sendMessage"]
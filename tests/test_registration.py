@@ -0,0 +1,64 @@
+'''
+Одновременная запись на мастер-класс: мест не продаётся больше, чем max_participants
+'''
+
+import asyncio
+
+from event import EventDatabase, REGISTRATION_OK, REGISTRATION_FULL, REGISTRATION_ALREADY
+
+USERS = 1500
+SEATS = 7
+CONNECTIONS = 8  # BEGIN IMMEDIATE с разных соединений упирается в busy_timeout
+
+
+async def _create_workshop(db_name, seats):
+    db = EventDatabase(db_name)
+    await db.connect()
+    await db.add_event("Мастер-классы", "Описание", "workshop")
+    await db.add_workshop(1, "Гончарное дело", "Описание", "Ведущий", seats)
+    await db.close()
+
+
+async def _register_concurrently(db_name, user_ids, connections=CONNECTIONS):
+    # Несколько экземпляров базы — несколько соединений, как у воркеров cluster.py
+    dbs = [EventDatabase(db_name) for _ in range(connections)]
+    for db in dbs:
+        await db.connect()
+    try:
+        # return_exceptions: соединения закрываются только после всех попыток
+        results = await asyncio.gather(*(
+            dbs[index % connections].register_user_for_workshop(user_id, 1, "Иван Иванов", "1")
+            for index, user_id in enumerate(user_ids)
+        ), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        assert not errors, f"{len(errors)} ошибок, первая: {errors[0]!r}"
+        workshop = await dbs[0].get_workshop_by_id(1)
+        participants = await dbs[0].get_workshop_participants(1)
+        return results, workshop, participants
+    finally:
+        for db in dbs:
+            await db.close()
+
+
+def test_concurrent_registrations_do_not_oversell(tmp_path):
+    db_name = str(tmp_path / "events.db")
+    asyncio.run(_create_workshop(db_name, SEATS))
+
+    results, workshop, participants = asyncio.run(_register_concurrently(db_name, list(range(1, USERS + 1))))
+
+    assert results.count(REGISTRATION_OK) == SEATS
+    assert results.count(REGISTRATION_FULL) == USERS - SEATS
+    assert workshop["current_participants"] == SEATS
+    assert len(participants) == SEATS
+
+
+def test_double_tap_registers_once(tmp_path):
+    db_name = str(tmp_path / "events.db")
+    asyncio.run(_create_workshop(db_name, SEATS))
+
+    results, workshop, participants = asyncio.run(_register_concurrently(db_name, [42] * 5))
+
+    assert results.count(REGISTRATION_OK) == 1
+    assert results.count(REGISTRATION_ALREADY) == 4
+    assert workshop["current_participants"] == 1
+    assert len(participants) == 1
@@ -0,0 +1,59 @@
+'''
+Вебхук: апдейт с верным секретным заголовком доходит до хендлера, без него — 403
+'''
+
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+
+from aiogram import Bot, Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+import webhook
+
+SECRET = "s3cret"
+
+
+def _update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Иван"},
+            "text": "/start",
+        },
+    }
+
+
+async def _post_updates(requests):
+    """requests: [(update_id, заголовки)]; возвращает статусы ответов и id обработанных апдейтов"""
+    handled = []
+    dp = Dispatcher(Bot("123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"))
+
+    async def start(message):
+        handled.append(message.message_id)
+
+    dp.register_message_handler(start, commands=["start"])
+
+    async with TestClient(TestServer(webhook.build_app(dp, path="/webhook"))) as client:
+        statuses = []
+        for update_id, headers in requests:
+            response = await client.post("/webhook", json=_update(update_id), headers=headers)
+            statuses.append(response.status)
+    return statuses, handled
+
+
+def test_webhook_checks_secret_header(monkeypatch):
+    monkeypatch.setattr(webhook.SecretWebhookRequestHandler, "secret_token", SECRET)
+
+    statuses, handled = asyncio.run(_post_updates([
+        (1, {webhook.SECRET_HEADER: SECRET}),
+        (2, {}),
+        (3, {webhook.SECRET_HEADER: "wrong"}),
+    ]))
+
+    assert statuses == [200, 403, 403]
+    assert handled == [1]
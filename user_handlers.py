@@ -8,8 +8,7 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from aiogram.dispatcher import FSMContext
 from event import *
 from state import EventState, OpenVoteState
-
-db = EventDatabase()
+from db_instance import db
 
 
 async def reset_state(message: types.Message, state: FSMContext):
@@ -155,14 +154,18 @@ async def process_open_vote_response(message: types.Message, state: FSMContext):
             await message.reply("❌ Слишком длинный ответ! Максимум 1000 символов.")
             return
         
-        # Сохраняем ответ с текстом
-        await db.add_response(
+        # Сохраняем ответ с текстом; None — ответ от этого пользователя уже есть
+        response_id = await db.add_response(
             event_id=event_id,
             user_id=message.from_user.id,
             user_name=message.from_user.full_name,
             option_id=free_option_id,
             custom_text=user_response  # Важно: передаем custom_text
         )
+        if response_id is None:
+            await message.reply("Вы уже участвовали в этом голосовании. Повторное участие невозможно.")
+            await state.finish()
+            return
         
         await message.reply(
             f"✅ <b>Ваш ответ сохранен!</b>\n\n"
@@ -241,13 +244,17 @@ async def handle_vote_selection(callback_query: types.CallbackQuery, state: FSMC
             return
         
         else:
-            # Обычное голосование
-            await db.add_response(
+            # Обычное голосование. Повторное нажатие не пишет второй голос: add_response вернёт None
+            response_id = await db.add_response(
                 event_id=event_id, 
                 user_id=user_id, 
                 user_name=user_name, 
                 option_id=option_id
             )
+            if response_id is None:
+                await callback_query.message.answer("Вы уже участвовали в этом голосовании. Повторное участие невозможно.")
+                await state.finish()
+                return
             
             # Уведомляем пользователя
             await callback_query.message.answer(
@@ -364,11 +371,11 @@ async def select_workshop(callback_query: types.CallbackQuery, state: FSMContext
         await callback_query.message.delete_reply_markup()  # Удаляем кнопки
         return
 
-    # Проверяем, зарегистрирован ли пользователь
-    registered = await db.is_user_registered_for_workshop(user_id, workshop_id)
-    if registered:
+    # Уже записанного не просим вводить имя и отряд. Проверка идёт по кэшу участия;
+    # защищает запись не она, а уникальный индекс в register_user_for_workshop
+    if await db.is_user_registered_for_workshop_event(user_id, workshop_id):
         await callback_query.message.answer(
-            "Вы уже записаны на этот мастер-класс.",
+            "Вы уже записаны на мастер-класс этого события.",
             parse_mode=ParseMode.HTML
         )
         await callback_query.message.delete_reply_markup()  # Удаляем кнопки
@@ -415,17 +422,35 @@ async def process_group_number(message: types.Message, state: FSMContext):
         await message.reply("Мастер-класс не найден.")
         return
 
-    success = await db.register_user_for_workshop(user_id, workshop_id, participant_name, group_number)
+    try:
+        result = await db.register_user_for_workshop(user_id, workshop_id, participant_name, group_number)
+    except Exception as e:
+        # Например, «database is locked» при пиковой нагрузке: место не занято, можно повторить
+        print(f"Error in process_group_number: {e}")
+        await message.reply("Не удалось записаться, попробуйте ещё раз: напишите /start и выберите мастер-класс.")
+        await state.finish()
+        return
 
-    if success:
+    if result == REGISTRATION_FULL:
+        await message.reply("К сожалению, места на этот мастер-класс закончились. Напишите /start и выберите другой МК!", parse_mode=ParseMode.HTML)
+        await state.finish()
+        return
+    if result == REGISTRATION_ALREADY:
+        await message.reply("Вы уже записаны на этот мастер-класс.", parse_mode=ParseMode.HTML)
+        await state.finish()
+        return
+    if result == REGISTRATION_NOT_FOUND:
+        await message.reply("Мастер-класс не найден.")
+        await state.finish()
+        return
+
+    if result == REGISTRATION_OK:
         # Получаем данные мастер-класса
         workshop_name = workshop['workshop_name']
         workshop_description = workshop['workshop_description']
-        max_participants = workshop['max_participants']
-        current_participants = workshop['current_participants']
-        
-        # Рассчитываем количество свободных мест
-        available_spots = max_participants - current_participants
+
+        # Свободные места считаем уже после бронирования
+        available_spots = await db.get_available_slots_for_workshop(workshop_id)
         
         # Формируем сообщение с данными мастер-класса и количеством свободных мест
         await message.reply(f"Вы успешно записаны на мастер-класс <b>{workshop_name}</b>.\n\n"
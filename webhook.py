@@ -0,0 +1,63 @@
+'''
+Режим вебхука: апдейты принимает aiohttp-сервер, а не цикл getUpdates
+'''
+
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler, BOT_DISPATCHER_KEY
+from aiogram.utils import executor
+
+from config import WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class SecretWebhookRequestHandler(WebhookRequestHandler):
+    """
+    Принимает апдейт, только если Telegram прислал наш секретный токен
+    """
+    secret_token = WEBHOOK_SECRET
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get(SECRET_HEADER) != self.secret_token:
+            raise web.HTTPForbidden()
+        return await super().post()
+
+
+def build_app(dispatcher, path=WEBHOOK_PATH):
+    """
+    aiohttp-приложение только с обработчиком вебхука, без регистрации в Telegram.
+    Нужно, чтобы поднять сервер внутри уже запущенного цикла (бенчмарк)
+    """
+    app = web.Application()
+    app.router.add_route("*", path, SecretWebhookRequestHandler, name="webhook_handler")
+    app[BOT_DISPATCHER_KEY] = dispatcher
+    return app
+
+
+def start_webhook(dispatcher, on_startup=None, on_shutdown=None,
+                  host=WEBAPP_HOST, port=WEBAPP_PORT, path=WEBHOOK_PATH, register=True):
+    """
+    Поднимает aiohttp-сервер на host:port и принимает апдейты на path.
+    При register=True регистрирует вебхук в Telegram на старте и снимает при остановке.
+    """
+    async def set_webhook(dp):
+        await dp.bot.set_webhook(f"{WEBHOOK_HOST}{path}", secret_token=WEBHOOK_SECRET or None)
+
+    async def delete_webhook(dp):
+        await dp.bot.delete_webhook()
+
+    startup = [on_startup] if on_startup else []
+    shutdown = [on_shutdown] if on_shutdown else []
+    if register:
+        startup.append(set_webhook)
+        shutdown.insert(0, delete_webhook)
+
+    executor.start_webhook(
+        dispatcher=dispatcher,
+        webhook_path=path,
+        request_handler=SecretWebhookRequestHandler,
+        on_startup=startup,
+        on_shutdown=shutdown,
+        host=host,
+        port=port,
+    )